@@ -1,10 +1,19 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 SQLDB = 'sqlite:///./aws-emulator.db'
 
-engine = create_engine(SQLDB, connect_args={"check_same_thread":False})
+# timeout: wait up to 30s for another worker's write lock instead of failing with "database is locked".
+engine = create_engine(SQLDB, connect_args={"check_same_thread":False, "timeout": 30})
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers in other workers proceed while one worker writes.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush= False)
 
@@ -15,4 +24,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations, applied once at startup.
+
+The applied version is recorded in the schema_version table and migrations run
+under an inter-process lock, so with N uvicorn workers exactly one applies them
+and the others find the schema already current.
+
+Migration 1 creates every table from the current models, so a fresh database
+is fully up to date after it. Later migrations upgrade databases created by
+older releases and must therefore be idempotent (add only what is missing).
+"""
+import os
+from sqlalchemy import inspect, text
+from db.database import Base, engine
+from db import models  # also registers the models on Base.metadata
+from services.leader import exclusive
+
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _add_index(conn, table: str, column: str):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+
+
+def _create_tables(conn):
+    Base.metadata.create_all(conn)
+
+
+def _add_lifecycle_and_node_columns(conn):
+    _add_column(conn, "buckets", "object_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "buckets", "total_bytes", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "objects", "size", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "objects", "expires_at", "DATETIME")
+    _add_column(conn, "objects", "expiry_rule_id", "INTEGER")
+    _add_index(conn, "objects", "bucket_name")
+    _add_index(conn, "objects", "expires_at")
+    _add_column(conn, "instances", "node", "VARCHAR")
+    _add_index(conn, "instances", "node")
+    _add_column(conn, "db_instances", "node", "VARCHAR")
+    _add_index(conn, "db_instances", "node")
+    _backfill_object_sizes(conn)
+
+
+def _backfill_object_sizes(conn):
+    """
+    Fill in sizes of objects stored before sizes were recorded, from their files
+    on disk, and recompute the bucket stats from the objects table.
+    """
+    rows = conn.execute(text("SELECT key, bucket_name, data_path FROM objects WHERE size = 0")).fetchall()
+    sizes = []
+    for key, bucket_name, data_path in rows:
+        try:
+            size = os.path.getsize(data_path)
+        except OSError:
+            continue
+        if size:
+            sizes.append({"size": size, "key": key, "bucket_name": bucket_name})
+    if sizes:
+        conn.execute(text("UPDATE objects SET size = :size WHERE key = :key AND bucket_name = :bucket_name"), sizes)
+    conn.execute(text(
+        "UPDATE buckets SET "
+        "object_count = (SELECT COUNT(*) FROM objects WHERE objects.bucket_name = buckets.name), "
+        "total_bytes = (SELECT COALESCE(SUM(size), 0) FROM objects WHERE objects.bucket_name = buckets.name)"
+    ))
+
+
+def _create_client_tokens(conn):
+    models.ClientToken.__table__.create(conn, checkfirst=True)
+
+
+def _create_capacity_reservations(conn):
+    models.CapacityReservation.__table__.create(conn, checkfirst=True)
+
+
+def _add_reservation_owner(conn):
+    _add_column(conn, "capacity_reservations", "boot_id", "VARCHAR")
+
+
+def _add_cached_image_origin(conn):
+    # Existing rows may be adopted local images, so they default to not evictable.
+    _add_column(conn, "cached_images", "pulled", "BOOLEAN NOT NULL DEFAULT 0")
+
+
+def _add_client_token_owner(conn):
+    _add_column(conn, "client_tokens", "owner", "VARCHAR")
+
+
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "add lifecycle, bucket stats and docker node columns", _add_lifecycle_and_node_columns),
+    (3, "create client_tokens", _create_client_tokens),
+    # Databases that already applied migration 2 before it backfilled sizes.
+    (4, "backfill object sizes and bucket stats", _backfill_object_sizes),
+    (5, "create capacity_reservations", _create_capacity_reservations),
+    (6, "add capacity reservation owner", _add_reservation_owner),
+    (7, "add cached image origin", _add_cached_image_origin),
+    (8, "add client token owner", _add_client_token_owner),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(conn) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, "
+        "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def migrate():
+    """
+    Bring the database schema up to LATEST_VERSION.
+    Cheap when the schema is already current: one query and no lock.
+    """
+    with engine.begin() as conn:
+        if _current_version(conn) >= LATEST_VERSION:
+            return
+
+    with exclusive("migrate"):
+        with engine.begin() as conn:
+            # Re-read under the lock: another worker may have migrated meanwhile.
+            version = _current_version(conn)
+            for number, description, upgrade in MIGRATIONS:
+                if number <= version:
+                    continue
+                print(f"Applying schema migration {number}: {description}")
+                upgrade(conn)
+                conn.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                             {"v": number, "d": description})
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Boolean
 from .database import Base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -15,19 +15,58 @@ class Bucket(Base):
     __tablename__ = "buckets"
     name = Column(String, primary_key=True)
     created_at = Column(DateTime, nullable=False, server_default=func.now())
+    object_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_bytes = Column(Integer, nullable=False, default=0, server_default="0")
 
     objects = relationship("S3Object", back_populates="bucket", cascade="all, delete-orphan")
+    lifecycle_rules = relationship("LifecycleRule", back_populates="bucket", cascade="all, delete-orphan")
 
 class S3Object(Base):
     __tablename__ = "objects"
 
     key = Column(String, primary_key=True)
-    bucket_name = Column(String, ForeignKey("buckets.name", ondelete="CASCADE"), primary_key=True)
+    bucket_name = Column(String, ForeignKey("buckets.name", ondelete="CASCADE"), primary_key=True, index=True)
     data_path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set either explicitly on upload or derived from a lifecycle rule
+    # (expiry_rule_id is only set in the latter case).
+    expires_at = Column(DateTime, nullable=True, index=True)
+    expiry_rule_id = Column(Integer, nullable=True)
 
     bucket = relationship("Bucket", back_populates="objects")
 
+class LifecycleRule(Base):
+    __tablename__ = "lifecycle_rules"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    bucket_name = Column(String, ForeignKey("buckets.name", ondelete="CASCADE"), nullable=False, index=True)
+    prefix = Column(String, nullable=False, default="")
+    expiration_days = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    bucket = relationship("Bucket", back_populates="lifecycle_rules")
+
+class Instance(Base):
+    """
+    EC2 instance metadata.
+    - id: Docker container ID (primary key).
+    - identifier: User-provided unique identifier (e.g., 'ec2-myinstance').
+    - ami_id: Docker image used as AMI (e.g., 'alpine:latest').
+    - instance_type: Instance type (default 't2.micro'), see services/capacity.py.
+    - status: Instance status ('running', 'stopped').
+    - node: Docker node that owns the container (None means the default node).
+    - created_at: Creation timestamp.
+    """
+    __tablename__ = "instances"
+    id = Column(String, primary_key=True)
+    identifier = Column(String, nullable=False, unique=True)
+    ami_id = Column(String, nullable=False)
+    instance_type = Column(String, nullable=False, default="t2.micro")
+    status = Column(String, nullable=False)
+    node = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
 class DBInstance(Base):
     __tablename__ = "db_instances"
     id = Column(String, primary_key=True)
@@ -38,4 +77,71 @@ class DBInstance(Base):
     port = Column(Integer, nullable=False)
     engine = Column(String, nullable=False, default="mysql")
     status = Column(String, nullable=False)
+    node = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class CachedImage(Base):
+    __tablename__ = "cached_images"
+    node = Column(String, primary_key=True)
+    image = Column(String, primary_key=True)
+    digest = Column(String, nullable=True)
+    image_id = Column(String, nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False)
+    error = Column(String, nullable=True)
+    pulled_at = Column(DateTime, nullable=True)
+    last_used_at = Column(DateTime, nullable=True, index=True)
+    # True only for images the cache pulled itself; adopted local images are never evicted.
+    pulled = Column(Boolean, nullable=False, default=False, server_default="0")
+
+class Command(Base):
+    __tablename__ = "commands"
+    id = Column(String, primary_key=True)
+    command = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    completed_at = Column(DateTime, nullable=True)
+
+    invocations = relationship("CommandInvocation", back_populates="command", cascade="all, delete-orphan")
+
+class CommandInvocation(Base):
+    __tablename__ = "command_invocations"
+    command_id = Column(String, ForeignKey("commands.id", ondelete="CASCADE"), primary_key=True)
+    instance_id = Column(String, primary_key=True)
+    identifier = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    exit_code = Column(Integer, nullable=True)
+    stdout = Column(String, nullable=False, default="")
+    stderr = Column(String, nullable=False, default="")
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    command = relationship("Command", back_populates="invocations")
+
+class ClientToken(Base):
+    __tablename__ = "client_tokens"
+    operation = Column(String, primary_key=True)
+    token = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    # Boot id of the worker running the call (see leader.worker_id).
+    owner = Column(String, nullable=True)
+    status = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    completed_at = Column(DateTime, nullable=True)
+
+class CapacityReservation(Base):
+    """
+    Capacity admitted for a launch whose instance row is not committed yet.
+    Shared by all uvicorn workers; `boot_id` identifies the owning worker (see
+    leader.worker_id), so reservations of a worker that died mid-launch can be discarded.
+    """
+    __tablename__ = "capacity_reservations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    node = Column(String, nullable=False, index=True)
+    vcpus = Column(Integer, nullable=False)
+    memory_mb = Column(Integer, nullable=False)
+    pid = Column(Integer, nullable=False)
+    boot_id = Column(String, nullable=True)
     created_at = Column(DateTime, nullable=False, server_default=func.now())
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -29,19 +29,39 @@ class UserResponse(UserBase):
 class ObjectUpload(BaseModel):
     key:str
     data:str
+    expires_at: Optional[datetime] = None
 
 class ObjectResponse(BaseModel):
     key:str
     created_at: Optional[datetime]
+    size: Optional[int] = None
+    expires_at: Optional[datetime] = None
 
 class BucketCreate(BaseModel):
     name:str
+    client_token:Optional[str] = None
 
 class BucketResponse(BaseModel):
     name:str
     created_at:Optional[datetime]
+    object_count: int = 0
+    total_bytes: int = 0
     objects: Optional[List[ObjectResponse]] = []
 
+class LifecycleRuleBase(BaseModel):
+    prefix: str = ""
+    expiration_days: int = Field(..., gt=0)
+
+class LifecycleRuleResponse(LifecycleRuleBase):
+    id: int
+
+class LifecycleConfiguration(BaseModel):
+    rules: List[LifecycleRuleBase]
+
+class LifecycleConfigurationResponse(BaseModel):
+    bucket_name: str
+    rules: List[LifecycleRuleResponse]
+
 #===============RDS models================
 class DBBase(BaseModel):
     identifier:str
@@ -50,12 +70,54 @@ class DBBase(BaseModel):
 
 class DBCreate(DBBase):
     engine:str
+    client_token:Optional[str] = None
 
 class DBResponse(DBBase):
     instance_id:str
     endpoint:str
     port:int
     status:str
+    node:Optional[str] = None
+
+#===============Image models================
+class ImagePull(BaseModel):
+    image:str
+    node:Optional[str] = None
+
+class ImageResponse(BaseModel):
+    node:str
+    image:str
+    digest:Optional[str]
+    size:int
+    status:str
+    error:Optional[str]
+    pulled_at:Optional[datetime]
+    last_used_at:Optional[datetime]
+
+#===============SSM models================
+class SendCommand(BaseModel):
+    command:str
+    instance_ids:Optional[List[str]] = None
+    identifier_pattern:Optional[str] = None
+    max_concurrency:int = Field(10, gt=0, le=100)
+
+class CommandInvocationResponse(BaseModel):
+    instance_id:str
+    identifier:str
+    status:str
+    exit_code:Optional[int]
+    stdout:str
+    stderr:str
+    started_at:Optional[datetime]
+    completed_at:Optional[datetime]
+
+class CommandResponse(BaseModel):
+    command_id:str
+    command:str
+    status:str
+    created_at:datetime
+    completed_at:Optional[datetime]
+    invocations: List[CommandInvocationResponse] = []
 
 #===============Auth models================
 
@@ -1,11 +1,30 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from db.database import engine
-from db import models
-from routes import user, auth, ec2, rds, s3
+from db import migrations
+from routes import user, auth, ec2, rds, s3, ssm, images as images_routes
+from services import lifecycle, images, leader, docker_nodes, capacity, idempotency
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app=FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema migrations run once (under a lock) no matter how many workers start.
+    await asyncio.to_thread(migrations.migrate)
+
+    background = [asyncio.create_task(lifecycle.run_sweeper()), asyncio.create_task(idempotency.run_pruner())]
+    if leader.background_jobs.try_acquire():
+        await asyncio.to_thread(capacity.discard_stale_reservations)
+        # Runs in the background so startup does not wait on registry pulls.
+        background.append(asyncio.create_task(asyncio.to_thread(images.prepull_all)))
+
+    yield
+
+    for task in background:
+        task.cancel()
+    docker_nodes.close_all()
+
+app=FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,8 +34,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-models.Base.metadata.create_all(engine)
-
 app.include_router(user.router)
 
 app.include_router(auth.router)
@@ -25,4 +42,8 @@ app.include_router(ec2.router)
 
 app.include_router(rds.router)
 
-app.include_router(s3.router)
\ No newline at end of file
+app.include_router(s3.router)
+
+app.include_router(ssm.router)
+
+app.include_router(images_routes.router)
\ No newline at end of file
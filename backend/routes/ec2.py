@@ -1,49 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, Query, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, String, DateTime, create_engine
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
 from db.database import get_db
+from db.models import Instance
 import docker
 import socket
-from sqlalchemy.sql import func
 from datetime import datetime
 import asyncio
 import json
+from typing import Optional
 from services.oauth2 import get_current_user
+from services import capacity, docker_nodes, idempotency, images, scheduler, stats
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-# Initialize Docker client (same as RDS)
-client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
-
-# SQLAlchemy base and engine
-Base = declarative_base()
-SQLDB = 'sqlite:///./aws-emulator.db'  # Match database path from db/database.py
-engine = create_engine(SQLDB, connect_args={"check_same_thread": False})
-
-# SQLAlchemy model for EC2 instances
-class Instance(Base):
-    """
-    SQLAlchemy model for the 'instances' table to store EC2 instance metadata.
-    Fields:
-    - id: Docker container ID (primary key).
-    - identifier: User-provided unique identifier (e.g., 'ec2-myinstance').
-    - ami_id: Docker image used as AMI (e.g., 'alpine:latest').
-    - instance_type: Instance type (default 't2.micro').
-    - status: Instance status ('running', 'stopped').
-    - created_at: Creation timestamp.
-    """
-    __tablename__ = "instances"
-    id = Column(String, primary_key=True)
-    identifier = Column(String, nullable=False, unique=True)
-    ami_id = Column(String, nullable=False)
-    instance_type = Column(String, nullable=False, default="t2.micro")
-    status = Column(String, nullable=False)
-    created_at = Column(DateTime, nullable=False, server_default=func.now())
-
-# Create the instances table when the module is imported
-Base.metadata.create_all(bind=engine)
-
 # Pydantic models for request/response validation
 class InstanceCreate(BaseModel):
     """
@@ -52,10 +23,12 @@ class InstanceCreate(BaseModel):
     - identifier: Unique name for the instance (e.g., 'myinstance').
     - ami_id: Docker image to use as AMI (e.g., 'alpine:latest').
     - instance_type: Optional instance type (default 't2.micro').
+    - client_token: Optional idempotency key; retries with the same token return the original result.
     """
     identifier: str = Field(..., example="myinstance")
     ami_id: str = Field(..., example="alpine:latest")
     instance_type: str = Field("t2.micro", example="t2.micro")
+    client_token: Optional[str] = Field(None, example="3f1c2b7e-launch-1")
 
 class InstanceResponse(BaseModel):
     """
@@ -66,12 +39,14 @@ class InstanceResponse(BaseModel):
     - ami_id: Docker image used.
     - instance_type: Instance type.
     - status: Instance status.
+    - node: Docker node running the instance.
     """
     instance_id: str
     identifier: str
     ami_id: str
     instance_type: str
     status: str
+    node: str
 
 class InstanceListResponse(BaseModel):
     """
@@ -81,6 +56,20 @@ class InstanceListResponse(BaseModel):
     """
     instances: list[InstanceResponse]
 
+class InstanceTypeResponse(BaseModel):
+    """
+    Pydantic model for an entry of the instance type catalog.
+    Fields:
+    - instance_type: Instance type name (e.g., 't3.large').
+    - vcpus: CPU quota in cores.
+    - memory_mb: Memory limit in MiB.
+    - pids: Maximum number of processes.
+    """
+    instance_type: str
+    vcpus: int
+    memory_mb: int
+    pids: int
+
 # WebSocket dependency for authentication
 security = HTTPBearer()
 
@@ -115,54 +104,121 @@ router = APIRouter(
     tags=["ec2"]
 )
 
+def _to_response(instance: Instance) -> InstanceResponse:
+    return InstanceResponse(
+        instance_id=instance.id,
+        identifier=instance.identifier,
+        ami_id=instance.ami_id,
+        instance_type=instance.instance_type,
+        status=instance.status,
+        node=instance.node or docker_nodes.DEFAULT_NODE
+    )
+
+@router.get("/instance-types", response_model=list[InstanceTypeResponse])
+def list_instance_types():
+    """
+    List the supported instance types and the container limits they map to.
+    """
+    return [
+        InstanceTypeResponse(instance_type=name, **spec)
+        for name, spec in capacity.INSTANCE_TYPES.items()
+    ]
+
+@router.get("/capacity")
+def get_capacity(db: Session = Depends(get_db)):
+    """
+    Report host, allocatable and committed capacity of every Docker node.
+    Unreachable nodes are reported with an error instead of capacity.
+    """
+    by_node = capacity.running_types_by_node(db)
+    report = {}
+    for node in docker_nodes.all_nodes():
+        try:
+            report[node.name] = capacity.capacity_report(node, by_node.get(node.name, []))
+        except Exception as e:
+            report[node.name] = {"error": str(e)}
+    return report
+
 @router.post("/instances", response_model=InstanceResponse)
 def create_instance(request: InstanceCreate, db: Session = Depends(get_db)):
     """
     Create a new EC2 instance using a Docker container.
-    - Creates a container with the specified AMI (Docker image) and 'sleep infinity'.
+    - Creates a container with the specified AMI (Docker image) and 'sleep infinity',
+      using the image's pinned digest from the image cache.
+    - Applies the CPU, memory and pids limits of the instance type.
+    - Places the container on a Docker node (see services/scheduler.py),
+      rejecting the launch if it would oversubscribe every node.
     - Stores metadata in SQLite (instances table).
-    - Checks for duplicate identifiers.
+    - Checks for duplicate identifiers, including launches of the same identifier still in flight.
+    - With a client_token, retries and concurrent duplicates return the original result
+      instead of launching another container (see services/idempotency.py).
     - Returns instance details.
-    Raises HTTPException for Docker errors or duplicate identifiers.
+    Raises HTTPException for Docker errors, unknown instance types, insufficient capacity or duplicate identifiers.
     """
-    # Check for duplicate identifier
-    existing_instance = db.query(Instance).filter(Instance.identifier == f"ec2-{request.identifier}").first()
-    if existing_instance:
-        raise HTTPException(status_code=400, detail="Instance identifier already exists")
+    result = idempotency.run_once(
+        "ec2:RunInstances",
+        request.client_token,
+        request.model_dump(exclude={"client_token"}),
+        lambda: _launch_instance(request, db).model_dump()
+    )
+    return InstanceResponse(**result)
 
-    try:
-        # Run Docker container
-        container = client.containers.run(
-            request.ami_id,
-            name=f"ec2-{request.identifier}",
-            command="sleep infinity",
-            detach=True
-        )
+def _launch_instance(request: InstanceCreate, db: Session) -> InstanceResponse:
+    identifier = f"ec2-{request.identifier}"
+    with idempotency.reserve_name("ec2", identifier, "Instance identifier already exists"):
+        # Check for duplicate identifier
+        existing_instance = db.query(Instance).filter(Instance.identifier == identifier).first()
+        if existing_instance:
+            raise HTTPException(status_code=400, detail="Instance identifier already exists")
 
-        # Store metadata in DB
-        db_instance = Instance(
-            id=container.id,
-            identifier=f"ec2-{request.identifier}",
-            ami_id=request.ami_id,
-            instance_type=request.instance_type,
-            status="running",
-            created_at=datetime.now()
-        )
-        db.add(db_instance)
-        db.commit()
-        db.refresh(db_instance)
+        limits = capacity.container_limits(request.instance_type)
 
-        return InstanceResponse(
-            instance_id=db_instance.id,
-            identifier=db_instance.identifier,
-            ami_id=db_instance.ami_id,
-            instance_type=db_instance.instance_type,
-            status=db_instance.status
-        )
-    except docker.errors.APIError as e:
-        raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating instance: {str(e)}")
+        container = None
+        try:
+            with scheduler.place(request.ami_id, capacity.running_types_by_node(db), request.instance_type) as node:
+                # Run Docker container
+                image_ref = images.ensure_image(node, request.ami_id)
+                container = node.client.containers.run(
+                    image_ref,
+                    name=identifier,
+                    command="sleep infinity",
+                    detach=True,
+                    **limits
+                )
+
+                # Store metadata in DB
+                db_instance = Instance(
+                    id=container.id,
+                    identifier=identifier,
+                    ami_id=request.ami_id,
+                    instance_type=request.instance_type,
+                    status="running",
+                    node=node.name,
+                    created_at=datetime.now()
+                )
+                db.add(db_instance)
+                db.commit()
+                # The row now owns the container; later failures must not remove it.
+                container = None
+            db.refresh(db_instance)
+
+            return _to_response(db_instance)
+        except Exception as e:
+            # Don't leave a running container behind that the database doesn't know about.
+            if container is not None:
+                db.rollback()
+                try:
+                    container.remove(force=True)
+                except docker.errors.APIError:
+                    pass
+            if isinstance(e, HTTPException):
+                raise
+            if isinstance(e, docker.errors.APIError) and e.status_code == 409 and container is None:
+                # Container name taken, e.g. by a concurrent create in another worker.
+                raise HTTPException(status_code=400, detail="Instance identifier already exists")
+            if isinstance(e, docker.errors.APIError):
+                raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error creating instance: {str(e)}")
 
 @router.get("/instances", response_model=InstanceListResponse)
 def list_instances(db: Session = Depends(get_db)):
@@ -173,43 +229,34 @@ def list_instances(db: Session = Depends(get_db)):
     """
     instances = db.query(Instance).all()
     return InstanceListResponse(
-        instances=[
-            InstanceResponse(
-                instance_id=instance.id,
-                identifier=instance.identifier,
-                ami_id=instance.ami_id,
-                instance_type=instance.instance_type,
-                status=instance.status
-            ) for instance in instances
-        ]
+        instances=[_to_response(instance) for instance in instances]
     )
 
 @router.post("/instances/{instance_id}/start", response_model=InstanceResponse)
 def start_instance(instance_id: str, db: Session = Depends(get_db)):
     """
     Start a stopped EC2 instance.
+    - Rejects the start if it would oversubscribe the host.
     - Starts the Docker container by ID.
     - Updates status to 'running' in the database.
     - Returns updated instance details.
-    Raises HTTPException if instance not found or Docker error occurs.
+    Raises HTTPException if instance not found, capacity is insufficient or Docker error occurs.
     """
     instance = db.query(Instance).filter(Instance.id == instance_id).first()
     if not instance:
         raise HTTPException(status_code=404, detail="Instance not found")
 
     try:
-        container = client.containers.get(instance_id)
-        container.start()
-        instance.status = "running"
-        db.commit()
+        node = docker_nodes.get_node(instance.node)
+        with capacity.reserve(node, instance.instance_type, exclude_id=instance.id):
+            container = node.client.containers.get(instance_id)
+            container.start()
+            instance.status = "running"
+            db.commit()
         db.refresh(instance)
-        return InstanceResponse(
-            instance_id=instance.id,
-            identifier=instance.identifier,
-            ami_id=instance.ami_id,
-            instance_type=instance.instance_type,
-            status=instance.status
-        )
+        return _to_response(instance)
+    except HTTPException:
+        raise
     except docker.errors.APIError as e:
         raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
     except Exception as e:
@@ -229,18 +276,14 @@ def stop_instance(instance_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Instance not found")
 
     try:
-        container = client.containers.get(instance_id)
+        container = docker_nodes.get_client(instance.node).containers.get(instance_id)
         container.stop()
         instance.status = "stopped"
         db.commit()
         db.refresh(instance)
-        return InstanceResponse(
-            instance_id=instance.id,
-            identifier=instance.identifier,
-            ami_id=instance.ami_id,
-            instance_type=instance.instance_type,
-            status=instance.status
-        )
+        return _to_response(instance)
+    except HTTPException:
+        raise
     except docker.errors.APIError as e:
         raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
     except Exception as e:
@@ -260,16 +303,51 @@ def delete_instance(instance_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Instance not found")
 
     try:
-        container = client.containers.get(instance_id)
+        container = docker_nodes.get_client(instance.node).containers.get(instance_id)
         container.remove(force=True)  # Force remove even if running
         db.delete(instance)
         db.commit()
         return None
+    except HTTPException:
+        raise
     except docker.errors.APIError as e:
         raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting instance: {str(e)}")
 
+def _stats_node(instance_id: str, db: Session):
+    instance = db.query(Instance).filter(Instance.id == instance_id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    node = docker_nodes.get_node(instance.node)
+    node.client  # the first use of a node's client contacts the daemon
+    return node
+
+async def _stats_stream(instance_id: str, db: Session):
+    # Blocking lookups run in the threadpool; get_stream() itself needs the event loop.
+    node = await run_in_threadpool(_stats_node, instance_id, db)
+    return stats.get_stream(node, instance_id)
+
+@router.get("/instances/{instance_id}/stats")
+async def get_instance_stats(instance_id: str, db: Session = Depends(get_db)):
+    """
+    Latest CPU, memory, network and block I/O sample plus the downsampled history
+    (last hour at 10s resolution by default) of an instance.
+    - Shares one upstream Docker stats stream per container with all other viewers.
+    - History starts accumulating on the first stats request for the container and is
+      kept when the upstream stream is closed for being idle.
+    - A request that starts the stream waits briefly for its first sample.
+    """
+    return await (await _stats_stream(instance_id, db)).ready_snapshot()
+
+@router.get("/instances/{instance_id}/stats/stream")
+async def stream_instance_stats(instance_id: str, db: Session = Depends(get_db)):
+    """
+    Live resource samples of an instance as server-sent events, about one per second.
+    """
+    stream = await _stats_stream(instance_id, db)
+    return StreamingResponse(stats.sse(stream), media_type="text/event-stream")
+
 @router.websocket("/instances/{instance_id}/console")
 async def ec2_console(websocket: WebSocket, instance_id: str, token: str = Query(...)):
     try:
@@ -282,6 +360,17 @@ async def ec2_console(websocket: WebSocket, instance_id: str, token: str = Query
     await websocket.accept()
     
     try:
+        from db.database import SessionLocal
+        db = SessionLocal()
+        try:
+            instance = db.query(Instance).filter(Instance.id == instance_id).first()
+        finally:
+            db.close()
+        if not instance:
+            await websocket.send_text("Error: Instance not found\r\n")
+            return
+
+        client = docker_nodes.get_client(instance.node)
         container = client.containers.get(instance_id)
         container.reload()
         if container.status != 'running':
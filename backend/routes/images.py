@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, HTTPException
+from db.schema import ImagePull, ImageResponse
+from typing import List
+from sqlalchemy.orm import Session
+from db.models import CachedImage
+from db.database import get_db
+from services import docker_nodes, images
+import docker
+
+router = APIRouter(
+    prefix="/images",
+    tags=["images"]
+)
+
+def _to_response(row: CachedImage) -> ImageResponse:
+    return ImageResponse(node=row.node, image=row.image, digest=row.digest, size=row.size, status=row.status,
+                         error=row.error, pulled_at=row.pulled_at, last_used_at=row.last_used_at)
+
+@router.get("/", response_model=List[ImageResponse])
+def list_images(db: Session = Depends(get_db)):
+    """
+    Cache status of AMI and DB engine images on every node, most recently used first.
+    """
+    rows = db.query(CachedImage).order_by(CachedImage.last_used_at.desc()).all()
+    return [_to_response(r) for r in rows]
+
+@router.post("/", response_model=List[ImageResponse])
+def pull_image(request: ImagePull, db: Session = Depends(get_db)):
+    """
+    Pull an image from the registry and re-pin its digest.
+    - Pulls onto the given node, or onto every node if none is given.
+    - Concurrent pulls of the same image share a single registry pull.
+    """
+    nodes = [docker_nodes.get_node(request.node)] if request.node else docker_nodes.all_nodes()
+    image = images.normalize(request.image)
+    for node in nodes:
+        try:
+            images.pull(node, image)
+        except docker.errors.APIError as e:
+            raise HTTPException(status_code=500, detail=f"Docker error on {node.name}: {str(e)}")
+    rows = db.query(CachedImage).filter(CachedImage.image == image,
+                                        CachedImage.node.in_([n.name for n in nodes])).all()
+    return [_to_response(r) for r in rows]
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from db.schema import DBCreate, DBResponse, List
 from sqlalchemy.orm import Session
 from db.database import get_db
 from db.models import DBInstance
 import docker
 from datetime import datetime
-
-client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
+from services import capacity, docker_nodes, idempotency, images, scheduler, stats
 
 
 router = APIRouter(
@@ -16,6 +17,16 @@ router = APIRouter(
 
 @router.post("/", response_model=DBResponse)
 def create_db(request:DBCreate, db:Session = Depends(get_db)):
+    result = idempotency.run_once(
+        "rds:CreateDBInstance",
+        request.client_token,
+        request.model_dump(exclude={"client_token"}),
+        lambda: _create_db(request, db).model_dump()
+    )
+    return DBResponse(**result)
+
+
+def _create_db(request:DBCreate, db:Session) -> DBResponse:
     engine=request.engine.lower()
     if engine=="postgres":
         image="postgres:latest"
@@ -34,48 +45,75 @@ def create_db(request:DBCreate, db:Session = Depends(get_db)):
         port_mapping = {"3306/tcp":None}
     else:
         raise HTTPException(400, "Unsupported Engine")
-    
-    try:
-        container = client.containers.run(
-            image,
-            name = f"db-{request.identifier}",
-            environment=env,
-            ports=port_mapping,
-            detach=True
-        )
-
-        container.reload()
-        port_info = list(container.attrs["NetworkSettings"]["Ports"].values())[0][0]["HostPort"]
-        container_id = container.id
-
-        db_instance = DBInstance(
-            id=container_id,
-            identifier=f"db-{request.identifier}",
-            username = request.username,
-            password = request.password,
-            endpoint = "localhost",
-            port=int(port_info),
-            engine = request.engine,
-            status = "running",
-            created_at=datetime.now()
-        )
-
-        db.add(db_instance)
-        db.commit()
-        db.refresh(db_instance)
-
-        return DBResponse(
-            identifier=db_instance.identifier,
-            username=db_instance.username,
-            password=db_instance.password,
-            instance_id=db_instance.id,
-            endpoint=db_instance.endpoint,
-            port=db_instance.port,
-            status=db_instance.status
-        )
-
-    except docker.errors.APIError as e:
-        raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
+
+    identifier = f"db-{request.identifier}"
+    with idempotency.reserve_name("rds", identifier, "DB identifier already exists"):
+        if db.query(DBInstance).filter(DBInstance.identifier == identifier).first():
+            raise HTTPException(400, "DB identifier already exists")
+
+        container = None
+        try:
+            profile = capacity.db_profile_type(engine)
+            with scheduler.place(image, capacity.running_types_by_node(db), profile) as node:
+                container = node.client.containers.run(
+                    images.ensure_image(node, image),
+                    name = identifier,
+                    environment=env,
+                    ports=port_mapping,
+                    detach=True,
+                    **capacity.container_limits(profile)
+                )
+
+                container.reload()
+                port_info = list(container.attrs["NetworkSettings"]["Ports"].values())[0][0]["HostPort"]
+                container_id = container.id
+
+                db_instance = DBInstance(
+                    id=container_id,
+                    identifier=identifier,
+                    username = request.username,
+                    password = request.password,
+                    endpoint = node.endpoint,
+                    port=int(port_info),
+                    engine = request.engine,
+                    status = "running",
+                    node = node.name,
+                    created_at=datetime.now()
+                )
+
+                db.add(db_instance)
+                db.commit()
+                # The row now owns the container; later failures must not remove it.
+                container = None
+            db.refresh(db_instance)
+
+            return DBResponse(
+                identifier=db_instance.identifier,
+                username=db_instance.username,
+                password=db_instance.password,
+                instance_id=db_instance.id,
+                endpoint=db_instance.endpoint,
+                port=db_instance.port,
+                status=db_instance.status,
+                node=db_instance.node
+            )
+
+        except Exception as e:
+            # Don't leave a running container behind that the database doesn't know about.
+            if container is not None:
+                db.rollback()
+                try:
+                    container.remove(force=True)
+                except docker.errors.APIError:
+                    pass
+            if isinstance(e, HTTPException):
+                raise
+            if isinstance(e, docker.errors.APIError) and e.status_code == 409 and container is None:
+                # Container name taken, e.g. by a concurrent create in another worker.
+                raise HTTPException(status_code=400, detail="DB identifier already exists")
+            if isinstance(e, docker.errors.APIError):
+                raise HTTPException(status_code=500, detail=f"Docker error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error creating DB instance: {str(e)}")
 
 
 @router.get("/", response_model = List[DBResponse])
@@ -90,7 +128,8 @@ def list_instances( db:Session = Depends(get_db)):
             "instance_id":i.id,
             "endpoint":i.endpoint,
             "port":i.port,
-            "status":i.status
+            "status":i.status,
+            "node":i.node or docker_nodes.DEFAULT_NODE
         })
 
     return response
@@ -108,9 +147,31 @@ def get_instance(instance_id,db:Session = Depends(get_db)):
         "instance_id":i.id,
         "endpoint":i.endpoint,
         "port":i.port,
-        "status":i.status
+        "status":i.status,
+        "node":i.node or docker_nodes.DEFAULT_NODE
     }
 
+def _stats_node(instance_id, db:Session):
+    instance = db.query(DBInstance).filter(DBInstance.id==instance_id).first()
+    if not instance:
+        raise HTTPException(404, "Instance not found")
+    node = docker_nodes.get_node(instance.node)
+    node.client  # the first use of a node's client contacts the daemon
+    return node
+
+async def _stats_stream(instance_id, db:Session):
+    # Blocking lookups run in the threadpool; get_stream() itself needs the event loop.
+    node = await run_in_threadpool(_stats_node, instance_id, db)
+    return stats.get_stream(node, instance_id)
+
+@router.get("/{instance_id}/stats")
+async def get_instance_stats(instance_id, db:Session = Depends(get_db)):
+    return await (await _stats_stream(instance_id, db)).ready_snapshot()
+
+@router.get("/{instance_id}/stats/stream")
+async def stream_instance_stats(instance_id, db:Session = Depends(get_db)):
+    return StreamingResponse(stats.sse(await _stats_stream(instance_id, db)), media_type="text/event-stream")
+
 @router.delete("/{instance_id}")
 def delete_instance(instance_id, db:Session=Depends(get_db)):
     instance = db.query(DBInstance).filter(DBInstance.id==instance_id).first()
@@ -118,7 +179,7 @@ def delete_instance(instance_id, db:Session=Depends(get_db)):
         raise HTTPException(404, "Instance not found")
     
     try:
-        container = client.containers.get(instance.identifier)
+        container = docker_nodes.get_client(instance.node).containers.get(instance.identifier)
         container.stop()
         container.remove()
     except Exception as e:
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
-import docker
-from db.schema import BucketCreate, BucketResponse, ObjectUpload, ObjectResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from db.schema import BucketCreate, BucketResponse, ObjectUpload, ObjectResponse, LifecycleConfiguration, LifecycleConfigurationResponse, LifecycleRuleResponse
 from typing import List
 from sqlalchemy.orm import Session
-from db.models import Bucket, S3Object
+from db.models import Bucket, S3Object, LifecycleRule
 from db.database import get_db
+from services import lifecycle, archive, idempotency
 import os
+import shutil
 from datetime import datetime
 
 router = APIRouter(
@@ -15,15 +18,25 @@ router = APIRouter(
 
 BASE_PATH = "data/s3"
 
-client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
-
 @router.post("/", response_model=BucketResponse)
 def create_bucket(request:BucketCreate, db:Session=Depends(get_db)):
+    result = idempotency.run_once(
+        "s3:CreateBucket",
+        request.client_token,
+        request.model_dump(exclude={"client_token"}),
+        lambda: _create_bucket(request, db).model_dump()
+    )
+    return BucketResponse(**result)
+
+
+def _create_bucket(request:BucketCreate, db:Session) -> BucketResponse:
     bucket_path = os.path.join(BASE_PATH, request.name)
 
-    if os.path.exists(bucket_path):
+    # makedirs fails atomically if a concurrent request created the bucket first.
+    try:
+        os.makedirs(bucket_path)
+    except FileExistsError:
         raise HTTPException(400, "Bucket already exists")
-    os.makedirs(bucket_path)
 
     db_bucket = Bucket(name=request.name, created_at=datetime.now(), objects=[])
     db.add(db_bucket)
@@ -39,8 +52,8 @@ def get_all_buckets(db:Session=Depends(get_db)):
     response=[]
     for b in buckets:
         objs = db.query(S3Object).filter(S3Object.bucket_name==b.name).all()
-        objects = [ObjectResponse(key=o.key, created_at=o.created_at) for o in objs]
-        response.append(BucketResponse(name=b.name, created_at=b.created_at, objects=objects))
+        objects = [ObjectResponse(key=o.key, created_at=o.created_at, size=o.size, expires_at=o.expires_at) for o in objs]
+        response.append(BucketResponse(name=b.name, created_at=b.created_at, object_count=b.object_count, total_bytes=b.total_bytes, objects=objects))
     return response
 
 
@@ -50,8 +63,8 @@ def get_bucket(bucket_name,db:Session=Depends(get_db)):
     if not bucket:
         raise HTTPException(404, "Bucket not found")
     objs = db.query(S3Object).filter(S3Object.bucket_name==bucket.name).all()
-    objects = [ObjectResponse(key=o.key, created_at=o.created_at) for o in objs]
-    return BucketResponse(name=bucket.name, created_at=bucket.created_at, objects=objects)
+    objects = [ObjectResponse(key=o.key, created_at=o.created_at, size=o.size, expires_at=o.expires_at) for o in objs]
+    return BucketResponse(name=bucket.name, created_at=bucket.created_at, object_count=bucket.object_count, total_bytes=bucket.total_bytes, objects=objects)
 
 
 @router.delete("/{bucket_name}")
@@ -62,9 +75,8 @@ def delete_bucket(bucket_name,db:Session=Depends(get_db)):
     
     bucket_path = os.path.join(BASE_PATH, bucket_name)
     if os.path.exists(bucket_path):
-        for f in os.listdir(bucket_path):
-            os.remove(os.path.join(bucket_path, f))
-        os.rmdir(bucket_path)
+        # Imported keys may contain '/', so objects can live in subdirectories.
+        shutil.rmtree(bucket_path)
     db.delete(bucket)
     db.commit()
     return {"msg" : "Deleted"}
@@ -79,27 +91,39 @@ def upload_object(bucket_name, request:ObjectUpload, db: Session = Depends(get_d
     file_path = os.path.join(bucket_path,request.key)
     with open(file_path, "w") as f:
         f.write(request.data)
-
-    obj = S3Object(key=request.key, bucket_name=bucket_name, data_path=file_path, created_at=datetime.now())
+    size = os.path.getsize(file_path)
+
+    created_at = datetime.now()
+    if request.expires_at:
+        expires_at, rule_id = request.expires_at, None
+        if expires_at.tzinfo:
+            expires_at = expires_at.astimezone().replace(tzinfo=None)
+    else:
+        expires_at, rule_id = lifecycle.expiry_for(db, bucket_name, request.key, created_at)
+
+    obj = S3Object(key=request.key, bucket_name=bucket_name, data_path=file_path, size=size,
+                   created_at=created_at, expires_at=expires_at, expiry_rule_id=rule_id)
     db.add(obj)
+    bucket.object_count += 1
+    bucket.total_bytes += size
     db.commit()
     db.refresh(obj)
 
-    return ObjectResponse(key=obj.key, created_at=obj.created_at)
+    return ObjectResponse(key=obj.key, created_at=obj.created_at, size=obj.size, expires_at=obj.expires_at)
 
 @router.get("/{bucket_name}/objects", response_model=List[ObjectResponse])
 def list_objects(bucket_name, db: Session = Depends(get_db)):
     bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
     if not bucket:
         raise HTTPException(404, "Bucket not found")
-    return [ObjectResponse(key=o.key, created_at=o.created_at) for o in bucket.objects]
+    return [ObjectResponse(key=o.key, created_at=o.created_at, size=o.size, expires_at=o.expires_at) for o in bucket.objects]
 
 @router.get("/buckets/{bucket_name}/objects/{key}", response_model=ObjectResponse)
 def get_object(bucket_name, key, db: Session = Depends(get_db)):
     obj = db.query(S3Object).filter_by(bucket_name=bucket_name, key=key).first()
     if not obj:
         raise HTTPException(status_code=404, detail="Object not found")
-    return ObjectResponse(key=obj.key, created_at=obj.created_at)
+    return ObjectResponse(key=obj.key, created_at=obj.created_at, size=obj.size, expires_at=obj.expires_at)
 
 @router.delete("/buckets/{bucket_name}/objects/{key}")
 def delete_object(bucket_name, key,db: Session = Depends(get_db)):
@@ -109,8 +133,95 @@ def delete_object(bucket_name, key,db: Session = Depends(get_db)):
     
     if os.path.exists(obj.data_path):
         os.remove(obj.data_path)
+    bucket = obj.bucket
+    bucket.object_count = max(bucket.object_count - 1, 0)
+    bucket.total_bytes = max(bucket.total_bytes - (obj.size or 0), 0)
     db.delete(obj)
     db.commit()
     return {"msg" : "Deleted"}
 
+def _lifecycle_response(bucket_name, rules):
+    return LifecycleConfigurationResponse(
+        bucket_name=bucket_name,
+        rules=[LifecycleRuleResponse(id=r.id, prefix=r.prefix, expiration_days=r.expiration_days) for r in rules]
+    )
+
+@router.put("/{bucket_name}/lifecycle", response_model=LifecycleConfigurationResponse)
+def put_lifecycle(bucket_name, request:LifecycleConfiguration, db: Session = Depends(get_db)):
+    """
+    Replace the lifecycle configuration of a bucket.
+    - Each rule expires objects whose key starts with `prefix` `expiration_days` after creation.
+    - The longest matching prefix wins; an explicit expires_at on upload overrides all rules.
+    - Existing objects are re-evaluated against the new rules.
+    """
+    bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
+    if not bucket:
+        raise HTTPException(404, "Bucket not found")
+    prefixes = [r.prefix for r in request.rules]
+    if len(prefixes) != len(set(prefixes)):
+        raise HTTPException(400, "Duplicate lifecycle rule prefix")
+
+    db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).delete(synchronize_session=False)
+    rules = [LifecycleRule(bucket_name=bucket_name, prefix=r.prefix, expiration_days=r.expiration_days,
+                           created_at=datetime.now()) for r in request.rules]
+    db.add_all(rules)
+    db.flush()
+    lifecycle.apply_rules(db, bucket_name)
+    db.commit()
+    return _lifecycle_response(bucket_name, rules)
+
+@router.get("/{bucket_name}/lifecycle", response_model=LifecycleConfigurationResponse)
+def get_lifecycle(bucket_name, db: Session = Depends(get_db)):
+    bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
+    if not bucket:
+        raise HTTPException(404, "Bucket not found")
+    rules = db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).all()
+    return _lifecycle_response(bucket_name, rules)
 
+@router.delete("/{bucket_name}/lifecycle")
+def delete_lifecycle(bucket_name, db: Session = Depends(get_db)):
+    bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
+    if not bucket:
+        raise HTTPException(404, "Bucket not found")
+    db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).delete(synchronize_session=False)
+    lifecycle.apply_rules(db, bucket_name)
+    db.commit()
+    return {"msg" : "Deleted"}
+
+def _import_tar(bucket_name, db: Session, chunks, prefix: str):
+    bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
+    if not bucket:
+        raise HTTPException(404, "Bucket not found")
+    return archive.import_tar(bucket_name, os.path.join(BASE_PATH, bucket_name), chunks, prefix)
+
+@router.post("/{bucket_name}/import")
+async def import_objects(bucket_name, request: Request, prefix: str = "", db: Session = Depends(get_db)):
+    """
+    Import a tar archive (optionally gzip/bzip2/xz compressed, detected automatically) into a bucket.
+    - The request body is the raw archive and is streamed, never held in memory.
+    - Each regular file becomes an object keyed `prefix + path in archive`; existing keys are replaced.
+    - Rows are bulk inserted in batched transactions and bucket stats updated per batch.
+    - An invalid or truncated archive fails with 400; objects extracted before the error are kept.
+    """
+    # The bucket lookup and the extraction are blocking; both run in the threadpool.
+    try:
+        return await run_in_threadpool(_import_tar, bucket_name, db, request.stream(), prefix)
+    except archive.tarfile.TarError as e:
+        raise HTTPException(400, f"Invalid tar archive: {e}")
+
+@router.get("/{bucket_name}/export")
+def export_objects(bucket_name, prefix: str = "", compression: str = Query("none", pattern="^(none|gz|bz2|xz)$"),
+                   db: Session = Depends(get_db)):
+    """
+    Stream a bucket, or the objects under `prefix`, as a tar archive.
+    The archive is generated on the fly with constant memory.
+    """
+    bucket = db.query(Bucket).filter(Bucket.name == bucket_name).first()
+    if not bucket:
+        raise HTTPException(404, "Bucket not found")
+    filename = f"{bucket_name}.tar" + ("" if compression == "none" else f".{compression}")
+    return StreamingResponse(
+        archive.export_tar(bucket_name, prefix, compression),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from db.schema import SendCommand, CommandResponse, CommandInvocationResponse
+from typing import List
+from sqlalchemy.orm import Session
+from db.models import Command, Instance, User
+from db.database import get_db
+from services import run_command
+from services.oauth2 import get_current_user
+from fnmatch import fnmatchcase
+
+router = APIRouter(
+    prefix="/ssm",
+    tags=["ssm"]
+)
+
+def _to_response(command: Command, with_invocations: bool = True) -> CommandResponse:
+    return CommandResponse(
+        command_id=command.id,
+        command=command.command,
+        status=command.status,
+        created_at=command.created_at,
+        completed_at=command.completed_at,
+        invocations=[
+            CommandInvocationResponse(
+                instance_id=i.instance_id,
+                identifier=i.identifier,
+                status=i.status,
+                exit_code=i.exit_code,
+                stdout=i.stdout,
+                stderr=i.stderr,
+                started_at=i.started_at,
+                completed_at=i.completed_at
+            ) for i in command.invocations
+        ] if with_invocations else []
+    )
+
+def _create_command(request: SendCommand, db: Session):
+    """
+    Resolve the targets of a command and record it. Returns (command_id, targets).
+    """
+    instances = db.query(Instance).all()
+    ids = set(request.instance_ids or [])
+    targets = [
+        run_command.Target(i.id, i.identifier, i.node) for i in instances
+        if i.id in ids or (request.identifier_pattern and fnmatchcase(i.identifier, request.identifier_pattern))
+    ]
+    missing = ids - {t.id for t in targets}
+    if missing:
+        raise HTTPException(404, f"Instances not found: {', '.join(sorted(missing))}")
+    if not targets:
+        raise HTTPException(404, "No instances match identifier_pattern")
+
+    return run_command.create_command(db, request.command, targets), targets
+
+@router.post("/commands")
+async def send_command(request: SendCommand, format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+                       db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Run a shell command on many EC2 instances at once (SSM RunCommand style).
+    - Requires an authenticated user, like the EC2 console.
+    - Targets are the given instance_ids and/or every instance whose identifier
+      matches identifier_pattern (a glob such as 'ec2-web-*').
+    - At most max_concurrency commands run at the same time.
+    - Streams per-instance stdout, stderr and exit codes as NDJSON (default) or SSE.
+    - Results are retained and can be fetched later from GET /ssm/commands/{command_id},
+      even if the client disconnects before the command finishes.
+    """
+    if not request.instance_ids and not request.identifier_pattern:
+        raise HTTPException(400, "Specify instance_ids or identifier_pattern")
+
+    # The lookups and the insert are blocking; keep them off the event loop.
+    command_id, targets = await run_in_threadpool(_create_command, request, db)
+    events = run_command.start(command_id, request.command, targets, request.max_concurrency)
+
+    return StreamingResponse(
+        run_command.stream_events(events, format),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"X-Command-Id": command_id}
+    )
+
+@router.get("/commands", response_model=List[CommandResponse])
+def list_commands(db: Session = Depends(get_db)):
+    commands = db.query(Command).order_by(Command.created_at.desc()).all()
+    return [_to_response(c, with_invocations=False) for c in commands]
+
+@router.get("/commands/{command_id}", response_model=CommandResponse)
+def get_command(command_id: str, db: Session = Depends(get_db)):
+    command = db.query(Command).filter(Command.id == command_id).first()
+    if not command:
+        raise HTTPException(404, "Command not found")
+    return _to_response(command)
@@ -0,0 +1,254 @@
+import io
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+from datetime import datetime
+import anyio.from_thread
+from sqlalchemy.dialects.sqlite import insert
+from db.database import SessionLocal
+from db.models import Bucket, S3Object, LifecycleRule
+from services import lifecycle
+
+# Rows inserted per transaction during imports.
+IMPORT_BATCH_SIZE = 1000
+CHUNK_SIZE = 1024 * 1024
+# Chunks buffered between the tar writer thread and the HTTP response.
+EXPORT_QUEUE_CHUNKS = 8
+
+EXPORT_MODES = {"none": "w|", "gz": "w|gz", "bz2": "w|bz2", "xz": "w|xz"}
+
+
+def object_path(bucket_path: str, key: str):
+    """
+    Path of an object's file inside the bucket directory, or None if the key
+    would escape it (absolute paths, '..').
+    """
+    if key.startswith("/") or ".." in key.split("/"):
+        return None
+    root = os.path.abspath(bucket_path)
+    path = os.path.abspath(os.path.join(root, key))
+    if not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+class _RequestReader(io.RawIOBase):
+    """
+    Blocking file object over an async request body, for use from a worker thread.
+    Holds at most one received chunk in memory.
+    """
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    async def _next(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = anyio.from_thread.run(self._next)
+            if chunk is None:
+                return 0
+            self._buffer = chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _flush(bucket_name: str, rows: dict):
+    """
+    Upsert one batch of object rows in a single transaction and adjust bucket stats,
+    accounting for keys that replaced existing objects.
+    `rows` maps key -> row, so a key repeated in the archive is written once per batch.
+    """
+    db = SessionLocal()
+    try:
+        keys = list(rows)
+        rows = list(rows.values())
+        replaced = db.query(S3Object.size).filter(S3Object.bucket_name == bucket_name, S3Object.key.in_(keys)).all()
+        stmt = insert(S3Object).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[S3Object.key, S3Object.bucket_name],
+            set_={c: stmt.excluded[c] for c in ("data_path", "size", "created_at", "expires_at", "expiry_rule_id")}
+        )
+        db.execute(stmt)
+        db.query(Bucket).filter(Bucket.name == bucket_name).update({
+            Bucket.object_count: Bucket.object_count + len(rows) - len(replaced),
+            Bucket.total_bytes: Bucket.total_bytes + sum(r["size"] for r in rows) - sum(s or 0 for (s,) in replaced)
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def import_tar(bucket_name: str, bucket_path: str, chunks, prefix: str = "") -> dict:
+    """
+    Extract a (optionally gzip/bzip2/xz compressed) tar stream into a bucket.
+    Runs in a worker thread; `chunks` is the async iterator of the request body.
+    - Memory use is bounded by one request chunk plus one copy buffer.
+    - Regular files become objects keyed `prefix + member name`; other members are skipped.
+    - Object rows are upserted in batches of IMPORT_BATCH_SIZE, one transaction each.
+    - Each file is written to a temporary file and renamed into place once complete.
+    - Members that cannot be stored (e.g. 'a/b' when 'a' is a file) are skipped.
+    - If the archive turns out to be invalid or truncated, the objects extracted so far
+      are still recorded before the error propagates, so no file is left without a row.
+    Returns counts of imported and skipped members and imported bytes.
+    """
+    db = SessionLocal()
+    try:
+        # Loaded once; the session is closed without commit so the rules stay readable.
+        rules = db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).all()
+    finally:
+        db.close()
+
+    imported, skipped, total_bytes = 0, 0, 0
+    rows = {}
+    reader = io.BufferedReader(_RequestReader(chunks), buffer_size=CHUNK_SIZE)
+    try:
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in tar:
+                name = member.name
+                while name.startswith("./"):
+                    name = name[2:]
+                key = prefix + name
+                path = object_path(bucket_path, key) if member.isfile() else None
+                if path is None:
+                    skipped += member.isfile()
+                    continue
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".import-")
+                except OSError:
+                    skipped += 1
+                    continue
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        shutil.copyfileobj(tar.extractfile(member), f, CHUNK_SIZE)
+                    os.replace(tmp_path, path)
+                except IsADirectoryError:
+                    os.remove(tmp_path)
+                    skipped += 1
+                    continue
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+
+                created_at = datetime.now()
+                expires_at, rule_id = lifecycle.expiry_from(lifecycle.match_rule_in(rules, key), created_at)
+                rows[key] = {"key": key, "bucket_name": bucket_name, "data_path": path, "size": member.size,
+                             "created_at": created_at, "expires_at": expires_at, "expiry_rule_id": rule_id}
+                imported += 1
+                total_bytes += member.size
+                if len(rows) >= IMPORT_BATCH_SIZE:
+                    batch, rows = rows, {}
+                    _flush(bucket_name, batch)
+    finally:
+        if rows:
+            _flush(bucket_name, rows)
+    return {"imported": imported, "skipped": skipped, "bytes": total_bytes}
+
+
+class _QueueWriter(io.RawIOBase):
+    """
+    File object handing written data to a bounded queue in CHUNK_SIZE pieces.
+    Blocks when the consumer falls behind; raises once the consumer has gone away.
+    """
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def send(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise BrokenPipeError("export cancelled")
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, b):
+        self._buffer += b
+        if len(self._buffer) >= CHUNK_SIZE:
+            self.send(bytes(self._buffer))
+            self._buffer.clear()
+        return len(b)
+
+    def flush_all(self):
+        if self._buffer:
+            self.send(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def _write_tar(bucket_name: str, prefix: str, mode: str, writer: _QueueWriter):
+    db = SessionLocal()
+    try:
+        objects = (
+            db.query(S3Object.key, S3Object.data_path, S3Object.created_at)
+            .filter(S3Object.bucket_name == bucket_name, lifecycle.key_startswith(prefix))
+            .order_by(S3Object.key)
+            .yield_per(IMPORT_BATCH_SIZE)
+        )
+        with tarfile.open(fileobj=writer, mode=mode) as tar:
+            for key, data_path, created_at in objects:
+                try:
+                    with open(data_path, "rb") as f:
+                        info = tar.gettarinfo(fileobj=f, arcname=key)
+                        info.uid = info.gid = 0
+                        info.uname = info.gname = ""
+                        if created_at:
+                            info.mtime = created_at.timestamp()
+                        tar.addfile(info, f)
+                except FileNotFoundError:
+                    continue
+        writer.flush_all()
+        writer.send(None)
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        print(f"Export of {bucket_name} failed: {e}")
+        try:
+            writer.send(e)
+        except BrokenPipeError:
+            pass
+    finally:
+        db.close()
+
+
+def export_tar(bucket_name: str, prefix: str = "", compression: str = "none"):
+    """
+    Generate a tar archive of a bucket (or a key prefix) as a stream of chunks.
+    The archive is written by a producer thread into a bounded queue, so memory
+    use stays constant regardless of bucket size. Closing the generator (client
+    disconnect) stops the producer.
+    """
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    writer = _QueueWriter(chunks, cancelled)
+    producer = threading.Thread(target=_write_tar, args=(bucket_name, prefix, EXPORT_MODES[compression], writer),
+                                daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
@@ -0,0 +1,228 @@
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from db.database import SessionLocal
+from db.models import Instance, DBInstance, CapacityReservation
+from services import docker_nodes, leader
+
+# Resource profile per EC2 instance type, applied as container limits.
+# vcpus -> CPU quota (nano_cpus), memory_mb -> hard memory limit, pids -> pids limit.
+INSTANCE_TYPES = {
+    "t2.nano":   {"vcpus": 1, "memory_mb": 512,   "pids": 128},
+    "t2.micro":  {"vcpus": 1, "memory_mb": 1024,  "pids": 256},
+    "t2.small":  {"vcpus": 1, "memory_mb": 2048,  "pids": 512},
+    "t2.medium": {"vcpus": 2, "memory_mb": 4096,  "pids": 1024},
+    "t2.large":  {"vcpus": 2, "memory_mb": 8192,  "pids": 2048},
+    "t3.nano":   {"vcpus": 2, "memory_mb": 512,   "pids": 128},
+    "t3.micro":  {"vcpus": 2, "memory_mb": 1024,  "pids": 256},
+    "t3.small":  {"vcpus": 2, "memory_mb": 2048,  "pids": 512},
+    "t3.medium": {"vcpus": 2, "memory_mb": 4096,  "pids": 1024},
+    "t3.large":  {"vcpus": 2, "memory_mb": 8192,  "pids": 2048},
+    "t3.xlarge": {"vcpus": 4, "memory_mb": 16384, "pids": 4096},
+    "m5.large":  {"vcpus": 2, "memory_mb": 8192,  "pids": 2048},
+    "m5.xlarge": {"vcpus": 4, "memory_mb": 16384, "pids": 4096},
+}
+
+# Fixed resource profile per RDS engine, applied as container limits and accounted
+# like an instance type named "db.<engine>", so databases count against node capacity.
+DB_ENGINE_PROFILES = {
+    "db.postgres": {"vcpus": 1, "memory_mb": 1024, "pids": 512},
+    "db.mysql":    {"vcpus": 1, "memory_mb": 1024, "pids": 512},
+}
+
+# How far committed instance resources may exceed the host's physical resources.
+# CPU is shared fairly by the kernel scheduler, so it can be oversubscribed;
+# memory limits are hard, so by default they are not.
+CPU_OVERCOMMIT_RATIO = float(os.getenv("EC2_CPU_OVERCOMMIT_RATIO", "4.0"))
+MEMORY_OVERCOMMIT_RATIO = float(os.getenv("EC2_MEMORY_OVERCOMMIT_RATIO", "1.0"))
+
+# Serializes admission within this worker; leader.exclusive("capacity") serializes it
+# across workers. Launches admitted but not yet recorded as running are kept as
+# CapacityReservation rows, so every worker accounts for them.
+_lock = threading.Lock()
+
+
+def get_instance_type(instance_type: str) -> dict:
+    """
+    Look up an instance type in the catalog.
+    Raises HTTPException 400 for unknown types.
+    """
+    spec = INSTANCE_TYPES.get(instance_type)
+    if spec is None:
+        raise HTTPException(400, f"Unsupported instance type: {instance_type}")
+    return spec
+
+
+def db_profile_type(engine: str) -> str:
+    return f"db.{engine.lower()}"
+
+
+def get_profile(resource_type: str) -> dict:
+    """
+    Resource profile of an EC2 instance type or an RDS engine profile ("db.<engine>").
+    Raises HTTPException 400 for unknown types.
+    """
+    spec = DB_ENGINE_PROFILES.get(resource_type)
+    return spec if spec is not None else get_instance_type(resource_type)
+
+
+def container_limits(resource_type: str) -> dict:
+    """
+    Keyword arguments for containers.run() enforcing the instance type's (or engine profile's) limits.
+    """
+    spec = get_profile(resource_type)
+    return {
+        "nano_cpus": spec["vcpus"] * 1_000_000_000,
+        "mem_limit": f"{spec['memory_mb']}m",
+        "pids_limit": spec["pids"],
+    }
+
+
+def running_types_by_node(db: Session, exclude_id: str = None) -> dict:
+    """
+    Instance types of all running EC2 instances and engine profiles ("db.<engine>")
+    of all running RDS instances, grouped by node, used for capacity accounting.
+    """
+    query = db.query(Instance.node, Instance.instance_type).filter(Instance.status == "running")
+    if exclude_id:
+        query = query.filter(Instance.id != exclude_id)
+    by_node = {}
+    for node, instance_type in query.all():
+        by_node.setdefault(node or docker_nodes.DEFAULT_NODE, []).append(instance_type)
+    for node, engine in db.query(DBInstance.node, DBInstance.engine).filter(DBInstance.status == "running").all():
+        by_node.setdefault(node or docker_nodes.DEFAULT_NODE, []).append(db_profile_type(engine))
+    return by_node
+
+
+def running_types(node_name: str, exclude_id: str = None) -> list:
+    """
+    Instance types currently recorded as running on one node, read in a fresh session
+    so that admission sees every launch committed so far.
+    """
+    db = SessionLocal()
+    try:
+        return running_types_by_node(db, exclude_id).get(node_name, [])
+    finally:
+        db.close()
+
+
+def host_capacity(info: dict) -> dict:
+    """
+    Physical CPU and memory of a Docker host, from the daemon's info().
+    """
+    return {"vcpus": info["NCPU"], "memory_mb": info["MemTotal"] // (1024 * 1024)}
+
+
+def allocatable_capacity(host: dict) -> dict:
+    return {
+        "vcpus": host["vcpus"] * CPU_OVERCOMMIT_RATIO,
+        "memory_mb": host["memory_mb"] * MEMORY_OVERCOMMIT_RATIO,
+    }
+
+
+def pending_reservations(node_name: str) -> list:
+    """
+    Resources of launches admitted on a node (by any worker) whose rows are not committed yet.
+    Reservations left behind by workers that have exited are ignored.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(CapacityReservation).filter(CapacityReservation.node == node_name).all()
+        return [{"vcpus": r.vcpus, "memory_mb": r.memory_mb} for r in rows if leader.worker_alive(r.boot_id)]
+    finally:
+        db.close()
+
+
+def committed_capacity(node_name: str, running_types) -> dict:
+    """
+    Sum the resources of the given running instance types plus pending launches on a node.
+    Unknown (legacy) types are not counted. The caller must hold _lock.
+    """
+    profiles = {**INSTANCE_TYPES, **DB_ENGINE_PROFILES}
+    specs = [profiles[t] for t in running_types if t in profiles] + pending_reservations(node_name)
+    return {
+        "vcpus": sum(s["vcpus"] for s in specs),
+        "memory_mb": sum(s["memory_mb"] for s in specs),
+    }
+
+
+def capacity_report(node, running_types) -> dict:
+    """
+    Host, allocatable (host * overcommit ratio) and committed capacity of a node.
+    """
+    host = host_capacity(node.client.info())
+    with _lock:
+        committed = committed_capacity(node.name, running_types)
+    return {"host": host, "allocatable": allocatable_capacity(host), "committed": committed}
+
+
+def admit(node_name: str, host: dict, spec: dict, instance_type: str, exclude_id: str = None) -> int:
+    """
+    Reserve `spec` on a node if it fits under the overcommit ratio.
+    Raises HTTPException 503 InsufficientInstanceCapacity otherwise.
+    Returns the reservation id; every successful admit must be paired with release().
+    Running instances and reservations are read under the lock (held across workers):
+    a launch releases its reservation only after committing its row, so every launch
+    is counted either as a row or as a reservation, never neither.
+    """
+    allocatable = allocatable_capacity(host)
+    with _lock, leader.exclusive("capacity"):
+        committed = committed_capacity(node_name, running_types(node_name, exclude_id))
+        if committed["vcpus"] + spec["vcpus"] > allocatable["vcpus"]:
+            raise HTTPException(503, f"InsufficientInstanceCapacity: not enough vCPUs for {instance_type}")
+        if committed["memory_mb"] + spec["memory_mb"] > allocatable["memory_mb"]:
+            raise HTTPException(503, f"InsufficientInstanceCapacity: not enough memory for {instance_type}")
+        db = SessionLocal()
+        try:
+            reservation = CapacityReservation(node=node_name, vcpus=spec["vcpus"], memory_mb=spec["memory_mb"],
+                                              pid=os.getpid(), boot_id=leader.worker_id(), created_at=datetime.now())
+            db.add(reservation)
+            db.commit()
+            return reservation.id
+        finally:
+            db.close()
+
+
+def release(reservation_id: int):
+    db = SessionLocal()
+    try:
+        db.query(CapacityReservation).filter(CapacityReservation.id == reservation_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def discard_stale_reservations():
+    """
+    Delete reservations of workers that have exited (e.g. killed mid-launch).
+    """
+    db = SessionLocal()
+    try:
+        stale = [r.id for r in db.query(CapacityReservation).all() if not leader.worker_alive(r.boot_id)]
+        if stale:
+            db.query(CapacityReservation).filter(CapacityReservation.id.in_(stale)).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+
+@contextmanager
+def reserve(node, instance_type: str, exclude_id: str = None):
+    """
+    Admission control for starting an instance on a given node.
+    - Rejects with HTTPException 503 if it would push committed capacity
+      past the configured overcommit ratio.
+    - Otherwise holds a reservation for the duration of the block, so concurrent
+      launches account for each other before their rows are committed.
+    The caller must have recorded the instance as running when the block exits.
+    `exclude_id` leaves the instance being started out of the running instances.
+    """
+    spec = get_profile(instance_type)
+    reservation_id = admit(node.name, host_capacity(node.client.info()), spec, instance_type, exclude_id)
+    try:
+        yield
+    finally:
+        release(reservation_id)
@@ -0,0 +1,95 @@
+import os
+import threading
+from urllib.parse import urlparse
+import docker
+from fastapi import HTTPException
+
+# Docker endpoints the emulator may place containers on, as "name=base_url" pairs
+# separated by commas, e.g. "local=unix:///var/run/docker.sock,ci2=tcp://10.0.0.2:2375".
+# The first node is the default for rows created before multi-node support.
+DOCKER_HOSTS = os.getenv("DOCKER_HOSTS", "local=unix:///var/run/docker.sock")
+# Connections kept per node; launches, execs and stats streams share one client per node.
+DOCKER_MAX_POOL_SIZE = int(os.getenv("DOCKER_MAX_POOL_SIZE", "32"))
+
+
+class DockerNode:
+    """
+    A Docker daemon the emulator can schedule containers on.
+    The client is created on first use and shared by every caller, so an
+    unreachable node does not prevent the API from starting.
+    """
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = docker.DockerClient(base_url=self.base_url, max_pool_size=DOCKER_MAX_POOL_SIZE)
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    @property
+    def endpoint(self) -> str:
+        """
+        Host name clients use to reach published container ports on this node.
+        """
+        if self.base_url.startswith("unix://"):
+            return "localhost"
+        return urlparse(self.base_url).hostname or "localhost"
+
+    def has_image(self, image: str) -> bool:
+        try:
+            self.client.images.get(image)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+
+def _parse_hosts(spec: str) -> dict:
+    nodes = {}
+    for i, entry in enumerate(e.strip() for e in spec.split(",")):
+        if not entry:
+            continue
+        name, sep, base_url = entry.partition("=")
+        if not sep:
+            name, base_url = f"node{i}", entry
+        nodes[name.strip()] = DockerNode(name.strip(), base_url.strip())
+    return nodes
+
+
+NODES = _parse_hosts(DOCKER_HOSTS)
+DEFAULT_NODE = next(iter(NODES))
+
+
+def all_nodes():
+    return list(NODES.values())
+
+
+def get_node(name: str = None) -> DockerNode:
+    """
+    Look up a node by name; None resolves to the default node.
+    Raises HTTPException 503 if the node is no longer configured.
+    """
+    node = NODES.get(name or DEFAULT_NODE)
+    if node is None:
+        raise HTTPException(503, f"Docker node '{name}' is not configured")
+    return node
+
+
+def get_client(name: str = None) -> docker.DockerClient:
+    return get_node(name).client
+
+
+def close_all():
+    for node in all_nodes():
+        node.close()
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from db.database import SessionLocal
+from db.models import ClientToken
+from services import leader
+
+# Completed tokens are replayed for this long, then forgotten (AWS also expires client tokens).
+TOKEN_TTL_HOURS = int(os.getenv("CLIENT_TOKEN_TTL_HOURS", "24"))
+PRUNE_INTERVAL_SECONDS = int(os.getenv("CLIENT_TOKEN_PRUNE_INTERVAL_SECONDS", "3600"))
+# How often a request polls for a duplicate that is in flight in another worker.
+POLL_INTERVAL_SECONDS = 0.2
+
+# Operations in flight in this process, keyed by (operation, token); duplicates join them.
+_inflight = {}
+# Resource names being created in this process, keyed by (namespace, name).
+# Across workers, duplicate names are rejected by Docker's container name check instead.
+_names = set()
+_lock = threading.Lock()
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _expired(row: ClientToken) -> bool:
+    return row.completed_at is not None and row.completed_at < datetime.now() - timedelta(hours=TOKEN_TTL_HOURS)
+
+
+def _claim(operation: str, token: str, request_hash: str):
+    """
+    Try to claim a token for this request.
+    Returns None if claimed, otherwise the finished ClientToken row to replay.
+    Waits while another live worker has the same token pending; a pending token
+    is only taken over once its owner has exited.
+    """
+    while True:
+        db = SessionLocal()
+        try:
+            db.add(ClientToken(operation=operation, token=token, request_hash=request_hash,
+                               owner=leader.worker_id(), status="pending", created_at=datetime.now()))
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+            row = db.query(ClientToken).filter_by(operation=operation, token=token).first()
+            if row is None:
+                continue
+            if _expired(row) or (row.status == "pending" and not leader.worker_alive(row.owner)):
+                db.delete(row)
+                db.commit()
+                continue
+            if row.request_hash != request_hash:
+                raise HTTPException(400, "IdempotentParameterMismatch: client token was already used with different parameters")
+            if row.status != "pending":
+                db.expunge(row)
+                return row
+        finally:
+            db.close()
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _finish(operation: str, token: str, **fields):
+    # Only while the row is still ours; never overwrite a row claimed by someone else.
+    db = SessionLocal()
+    try:
+        db.query(ClientToken).filter_by(operation=operation, token=token, owner=leader.worker_id()).update(
+            dict(fields, completed_at=datetime.now())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _release(operation: str, token: str):
+    db = SessionLocal()
+    try:
+        db.query(ClientToken).filter_by(operation=operation, token=token, owner=leader.worker_id()).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def prune_tokens() -> int:
+    """
+    Delete completed tokens older than TOKEN_TTL_HOURS and pending tokens of workers that have exited.
+    Returns the number of tokens deleted.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now() - timedelta(hours=TOKEN_TTL_HOURS)
+        deleted = db.query(ClientToken).filter(ClientToken.completed_at < cutoff).delete(synchronize_session=False)
+        pending = db.query(ClientToken).filter(ClientToken.status == "pending").all()
+        for row in pending:
+            if not leader.worker_alive(row.owner):
+                db.delete(row)
+                deleted += 1
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+async def run_pruner(interval: int = PRUNE_INTERVAL_SECONDS):
+    """
+    Background task that periodically prunes client tokens.
+    With several uvicorn workers only the elected leader prunes.
+    """
+    while True:
+        if leader.background_jobs.try_acquire():
+            try:
+                await asyncio.to_thread(prune_tokens)
+            except Exception as e:
+                print(f"Client token pruning failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def _replay(row: ClientToken) -> dict:
+    if row.status == "succeeded":
+        return json.loads(row.response)
+    raise HTTPException(row.status_code, json.loads(row.response))
+
+
+def _run_claimed(operation: str, token: str, request_hash: str, create):
+    row = _claim(operation, token, request_hash)
+    if row is not None:
+        return _replay(row)
+    try:
+        result = create()
+    except HTTPException as e:
+        if e.status_code < 500:
+            # Client errors are deterministic: replay them for retries with the same token.
+            _finish(operation, token, status="failed", status_code=e.status_code, response=json.dumps(e.detail))
+        else:
+            _release(operation, token)
+        raise
+    except BaseException:
+        _release(operation, token)
+        raise
+    _finish(operation, token, status="succeeded", status_code=200, response=json.dumps(result, default=str))
+    return result
+
+
+def run_once(operation: str, token: str, payload: dict, create) -> dict:
+    """
+    Run a create call at most once per client token.
+    - `payload` is the request without the token; reusing a token with a different
+      payload fails with 400 IdempotentParameterMismatch.
+    - Concurrent duplicates in this process join the in-flight call; duplicates in
+      other workers wait for the persisted result.
+    - Successful results and client errors (4xx) are stored and replayed to retries;
+      server errors release the token so the call can be retried.
+    `create` returns a JSON-serializable dict. Without a token it is simply called.
+    """
+    if not token:
+        return create()
+
+    key = (operation, token)
+    with _lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    if not leader:
+        # Joining is only valid for the same parameters.
+        result_hash, result = future.result()
+        if result_hash != fingerprint(payload):
+            raise HTTPException(400, "IdempotentParameterMismatch: client token was already used with different parameters")
+        return result
+
+    request_hash = fingerprint(payload)
+    try:
+        result = _run_claimed(operation, token, request_hash, create)
+        future.set_result((request_hash, result))
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+@contextmanager
+def reserve_name(namespace: str, name: str, message: str):
+    """
+    Reject a create whose resource name is already being created in this process,
+    so concurrent duplicates fail fast instead of racing to the Docker daemon.
+    """
+    key = (namespace, name)
+    with _lock:
+        if key in _names:
+            raise HTTPException(400, message)
+        _names.add(key)
+    try:
+        yield
+    finally:
+        with _lock:
+            _names.discard(key)
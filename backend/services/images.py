@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+import docker
+from sqlalchemy.exc import IntegrityError
+from db.database import SessionLocal
+from db.models import CachedImage
+from services import docker_nodes
+
+# Disk budget per node for images managed by the cache; least recently used images beyond it are removed.
+IMAGE_CACHE_BUDGET_BYTES = int(os.getenv("IMAGE_CACHE_BUDGET_BYTES", str(20 * 1024 ** 3)))
+
+# In-flight pulls keyed by (node, image) so concurrent launches share one pull.
+# This is per worker; concurrent pulls of one image from several workers are
+# merged by the Docker daemon itself.
+_inflight = {}
+_lock = threading.Lock()
+
+
+def normalize(image: str) -> str:
+    """
+    Add the implicit ':latest' tag, so 'alpine' and 'alpine:latest' share a cache entry.
+    """
+    if "@" in image:
+        return image
+    return image if ":" in image.rsplit("/", 1)[-1] else f"{image}:latest"
+
+
+# Images pulled onto every node at startup and never evicted (normalized, as cache rows are).
+PREPULL_IMAGES = [
+    normalize(i.strip()) for i in os.getenv("PREPULL_IMAGES", "alpine:latest,postgres:latest,mysql:latest").split(",")
+    if i.strip()
+]
+
+
+def _digest_of(image: str, local) -> str:
+    """
+    Immutable reference for a local image: the repo digest matching the image's
+    repository, or the image ID for images that were never pulled from a registry.
+    """
+    repo = image.split("@")[0] if "@" in image else image.rsplit(":", 1)[0]
+    digests = local.attrs.get("RepoDigests") or []
+    for d in digests:
+        if d.split("@")[0] == repo:
+            return d
+    return digests[0] if digests else local.id
+
+
+def _save(node_name: str, image: str, **fields):
+    db = SessionLocal()
+    try:
+        for attempt in range(2):
+            row = db.query(CachedImage).filter_by(node=node_name, image=image).first()
+            if row is None:
+                row = CachedImage(node=node_name, image=image, size=0, status="pulling")
+                db.add(row)
+            for k, v in fields.items():
+                setattr(row, k, v)
+            try:
+                db.commit()
+                return
+            except IntegrityError:
+                # Another worker inserted the row first; update it instead.
+                db.rollback()
+                if attempt:
+                    raise
+    finally:
+        db.close()
+
+
+def _record_ready(node_name: str, image: str, local, pulled: bool = False):
+    """
+    Record an image as ready on a node. `pulled` marks images the cache pulled itself;
+    images adopted from the node (e.g. locally built AMIs) keep their previous origin.
+    """
+    digest = _digest_of(image, local)
+    now = datetime.now()
+    fields = dict(digest=digest, image_id=local.id, size=local.attrs.get("Size", 0),
+                  status="ready", error=None, last_used_at=now)
+    if pulled:
+        fields.update(pulled=True, pulled_at=now)
+    _save(node_name, image, **fields)
+    return digest
+
+
+def evict(node, keep: str = None):
+    """
+    Remove least recently used cached images until the node is within IMAGE_CACHE_BUDGET_BYTES.
+    Only images the cache pulled itself are removed; adopted images (which may not be
+    pullable again), pre-pulled images, `keep` and images still used by containers are skipped.
+    """
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(CachedImage)
+            .filter(CachedImage.node == node.name, CachedImage.status == "ready", CachedImage.pulled.is_(True))
+            .order_by(CachedImage.last_used_at)
+            .all()
+        )
+        total = sum(r.size for r in rows)
+        for row in rows:
+            if total <= IMAGE_CACHE_BUDGET_BYTES:
+                break
+            if row.image in PREPULL_IMAGES or row.image == keep:
+                continue
+            try:
+                node.client.images.remove(row.image_id or row.image)
+            except docker.errors.ImageNotFound:
+                pass
+            except docker.errors.APIError as e:
+                # 409: still referenced by a container or another tag.
+                print(f"Not evicting {row.image} from {node.name}: {e}")
+                continue
+            total -= row.size
+            db.delete(row)
+            db.commit()
+    finally:
+        db.close()
+
+
+def pull(node, image: str) -> str:
+    """
+    Pull an image onto a node and pin its digest.
+    Concurrent calls for the same node and image wait for a single pull.
+    Returns the pinned digest reference.
+    """
+    image = normalize(image)
+    key = (node.name, image)
+    with _lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    if not leader:
+        return future.result()
+
+    try:
+        _save(node.name, image, status="pulling", error=None)
+        local = node.client.images.pull(image)
+        digest = _record_ready(node.name, image, local, pulled=True)
+        future.set_result(digest)
+    except Exception as e:
+        _save(node.name, image, status="failed", error=str(e))
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+    evict(node, keep=image)
+    return digest
+
+
+def ensure_image(node, image: str) -> str:
+    """
+    Resolve an image to a pinned reference available on the node.
+    - A cached digest is reused as long as it is still present, so ':latest'
+      is resolved once rather than on every launch.
+    - Images already on the node are adopted without contacting the registry.
+    - Otherwise the image is pulled (single-flight, see pull()).
+    """
+    image = normalize(image)
+    db = SessionLocal()
+    try:
+        row = db.query(CachedImage).filter_by(node=node.name, image=image).first()
+        if row and row.status == "ready" and row.digest:
+            try:
+                node.client.images.get(row.digest)
+                row.last_used_at = datetime.now()
+                db.commit()
+                return row.digest
+            except docker.errors.ImageNotFound:
+                pass
+    finally:
+        db.close()
+
+    try:
+        local = node.client.images.get(image)
+        return _record_ready(node.name, image, local)
+    except docker.errors.ImageNotFound:
+        return pull(node, image)
+
+
+def prepull_all():
+    """
+    Make sure every PREPULL_IMAGES entry is cached on every node.
+    Failures are logged and left for the next launch to retry.
+    """
+    for node in docker_nodes.all_nodes():
+        for image in PREPULL_IMAGES:
+            try:
+                ensure_image(node, image)
+            except Exception as e:
+                print(f"Pre-pull of {image} on {node.name} failed: {e}")
@@ -0,0 +1,87 @@
+import fcntl
+import os
+import uuid
+from contextlib import contextmanager
+
+# Lock files coordinating uvicorn workers on the same host.
+LOCK_DIR = os.getenv("LOCK_DIR", ".")
+
+
+@contextmanager
+def exclusive(name: str):
+    """
+    Hold a blocking inter-process lock for the duration of the block,
+    e.g. so that only one worker runs schema migrations at a time.
+    """
+    with open(os.path.join(LOCK_DIR, f".{name}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class LeaderLock:
+    """
+    Non-blocking inter-process lock electing one worker to run background jobs.
+    The lock is held until the process exits, at which point the OS releases it
+    and the next worker to call try_acquire() takes over.
+    """
+    def __init__(self, name: str):
+        self.path = os.path.join(LOCK_DIR, f".{name}.lock")
+        self._file = None
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        if self.held:
+            return True
+        if self._file is None:
+            self._file = open(self.path, "w")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.held = True
+        return True
+
+
+# Elects the worker that runs the lifecycle sweeper and image pre-pull.
+background_jobs = LeaderLock("background-jobs")
+
+# Identifies this worker process. Unlike the pid it is never reused by a later
+# process (a restarted worker in a container typically gets the same pid).
+BOOT_ID = uuid.uuid4().hex
+_worker_lock = LeaderLock(f"worker-{BOOT_ID}")
+
+
+def worker_id() -> str:
+    """
+    Boot id of this worker, to record as the owner of shared state.
+    The worker holds a lock file named after it for as long as it runs.
+    """
+    _worker_lock.try_acquire()
+    return BOOT_ID
+
+
+def worker_alive(boot_id: str) -> bool:
+    """
+    Whether the worker with this boot id is still running, i.e. still holds its lock file.
+    Unknown boot ids (and None) are considered dead.
+    """
+    if boot_id == BOOT_ID:
+        return True
+    if not boot_id:
+        return False
+    path = os.path.join(LOCK_DIR, f".worker-{boot_id}.lock")
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return False
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        # The owner is gone; its lock file is no longer needed.
+        os.remove(path)
+        return False
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.database import SessionLocal
+from db.models import Bucket, S3Object, LifecycleRule
+from services import leader
+
+SWEEP_INTERVAL_SECONDS = int(os.getenv("S3_SWEEP_INTERVAL_SECONDS", "60"))
+SWEEP_BATCH_SIZE = int(os.getenv("S3_SWEEP_BATCH_SIZE", "500"))
+# Pause between batches so foreground writers can grab the SQLite write lock.
+SWEEP_BATCH_PAUSE_SECONDS = 0.05
+
+
+def match_rule(db: Session, bucket_name: str, key: str):
+    """
+    Return the lifecycle rule of the bucket that applies to `key`.
+    When several prefixes match, the longest one wins.
+    """
+    rules = db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).all()
+    return match_rule_in(rules, key)
+
+
+def match_rule_in(rules, key: str):
+    """
+    Same as match_rule() against an already loaded list of rules (for bulk imports).
+    """
+    best = None
+    for rule in rules:
+        if key.startswith(rule.prefix) and (best is None or len(rule.prefix) > len(best.prefix)):
+            best = rule
+    return best
+
+
+def key_startswith(prefix: str):
+    """
+    Case-sensitive SQL prefix match on object keys, equivalent to str.startswith().
+    (SQLite LIKE ignores case, so startswith() on the column would match more keys.)
+    """
+    return func.substr(S3Object.key, 1, len(prefix)) == prefix
+
+
+def expiry_for(db: Session, bucket_name: str, key: str, created_at: datetime):
+    """
+    Compute the (expires_at, rule_id) pair for a new object from the bucket's lifecycle rules.
+    Returns (None, None) when no rule applies.
+    """
+    return expiry_from(match_rule(db, bucket_name, key), created_at)
+
+
+def expiry_from(rule, created_at: datetime):
+    if rule is None:
+        return None, None
+    return created_at + timedelta(days=rule.expiration_days), rule.id
+
+
+def apply_rules(db: Session, bucket_name: str):
+    """
+    Recompute rule-derived expiry for the objects of a bucket after its configuration changed.
+    Objects with an explicit expires_at (no expiry_rule_id) are left untouched.
+    Runs as a handful of UPDATE statements over the bucket_name index; the caller commits.
+    Expiry is computed in SQL in the same format as expiry_from() writes it
+    (datetime() drops the fractional seconds, so they are carried over from created_at).
+    """
+    db.query(S3Object).filter(
+        S3Object.bucket_name == bucket_name,
+        S3Object.expiry_rule_id.isnot(None)
+    ).update({S3Object.expires_at: None, S3Object.expiry_rule_id: None}, synchronize_session=False)
+
+    rules = db.query(LifecycleRule).filter(LifecycleRule.bucket_name == bucket_name).all()
+    # Longest prefix first: once an object has an expiry, shorter prefixes skip it.
+    for rule in sorted(rules, key=lambda r: len(r.prefix), reverse=True):
+        db.query(S3Object).filter(
+            S3Object.bucket_name == bucket_name,
+            S3Object.expires_at.is_(None),
+            key_startswith(rule.prefix)
+        ).update({
+            S3Object.expires_at: func.datetime(S3Object.created_at, f"+{rule.expiration_days} days")
+                                     .op("||")(func.substr(S3Object.created_at, 20)),
+            S3Object.expiry_rule_id: rule.id
+        }, synchronize_session=False)
+
+
+def sweep_batch(db: Session, now: datetime, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """
+    Delete up to `batch_size` expired objects in a single transaction.
+    - Walks the expires_at index, never the buckets themselves.
+    - Removes the backing files, the rows, and adjusts bucket stats.
+    Returns the number of objects deleted.
+    """
+    expired = (
+        db.query(S3Object)
+        .filter(S3Object.expires_at.isnot(None), S3Object.expires_at <= now)
+        .order_by(S3Object.expires_at)
+        .limit(batch_size)
+        .all()
+    )
+    if not expired:
+        return 0
+
+    reclaimed = defaultdict(lambda: [0, 0])
+    for obj in expired:
+        # File first: if the commit fails the row is simply swept again.
+        try:
+            os.remove(obj.data_path)
+        except FileNotFoundError:
+            pass
+        reclaimed[obj.bucket_name][0] += 1
+        reclaimed[obj.bucket_name][1] += obj.size or 0
+        db.delete(obj)
+
+    for bucket_name, (count, size) in reclaimed.items():
+        db.query(Bucket).filter(Bucket.name == bucket_name).update({
+            Bucket.object_count: func.max(Bucket.object_count - count, 0),
+            Bucket.total_bytes: func.max(Bucket.total_bytes - size, 0)
+        }, synchronize_session=False)
+
+    db.commit()
+    return len(expired)
+
+
+def sweep_expired(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """
+    Delete every object that has expired, one bounded batch at a time.
+    Returns the total number of objects deleted.
+    """
+    now = datetime.now()
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            deleted = sweep_batch(db, now, batch_size)
+        finally:
+            db.close()
+        total += deleted
+        if deleted < batch_size:
+            return total
+        time.sleep(SWEEP_BATCH_PAUSE_SECONDS)
+
+
+async def run_sweeper(interval: int = SWEEP_INTERVAL_SECONDS):
+    """
+    Background task that periodically sweeps expired objects.
+    The sweep itself runs in a worker thread so the event loop keeps serving requests.
+    With several uvicorn workers only the elected leader sweeps.
+    """
+    while True:
+        if not leader.background_jobs.try_acquire():
+            await asyncio.sleep(interval)
+            continue
+        try:
+            deleted = await asyncio.to_thread(sweep_expired)
+            if deleted:
+                print(f"Lifecycle sweeper deleted {deleted} expired objects")
+        except Exception as e:
+            print(f"Lifecycle sweep failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime
+from db.database import SessionLocal
+from db.models import Command, CommandInvocation
+from services import docker_nodes
+
+# Retained output per stream and instance, as in SSM's GetCommandInvocation.
+OUTPUT_LIMIT = 24000
+# Events buffered for the streaming client; a slow client drops the oldest output
+# instead of buffering the whole fleet's output (full results are retained anyway).
+EVENT_BUFFER = 1024
+
+# Detached snapshot of an Instance row, safe to use from worker threads.
+Target = namedtuple("Target", ["id", "identifier", "node"])
+
+# Strong references to running fan-outs; the event loop only keeps weak ones.
+_running = set()
+
+
+class EventStream:
+    """
+    Bounded queue of command events for one streaming client.
+    Must be used from the event loop; worker threads go through call_soon_threadsafe.
+    - When the buffer is full the oldest event is dropped, as in services/stats.py.
+    - Once the client has gone away (close()), events are discarded.
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=EVENT_BUFFER)
+        self.closed = False
+
+    def publish(self, event: dict):
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def close(self):
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def _save_invocation(command_id: str, instance_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(CommandInvocation).filter_by(command_id=command_id, instance_id=instance_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _finish_command(command_id: str, status: str):
+    db = SessionLocal()
+    try:
+        db.query(Command).filter_by(id=command_id).update({"status": status, "completed_at": datetime.now()})
+        db.commit()
+    finally:
+        db.close()
+
+
+def create_command(db, command: str, instances) -> str:
+    """
+    Record a command and one pending invocation per target.
+    Returns the new command id.
+    """
+    command_id = str(uuid.uuid4())
+    db.add(Command(id=command_id, command=command, status="in_progress", created_at=datetime.now()))
+    for instance in instances:
+        db.add(CommandInvocation(command_id=command_id, instance_id=instance.id, identifier=instance.identifier,
+                                 status="pending", stdout="", stderr=""))
+    db.commit()
+    return command_id
+
+
+def _exec(loop, events, command_id, instance, command):
+    """
+    Run `command` in the instance's container (worker thread).
+    Each demultiplexed chunk is published as an event as it arrives, while a client is listening.
+    Returns (exit_code, stdout, stderr) with output truncated to OUTPUT_LIMIT.
+    """
+    client = docker_nodes.get_client(instance.node)
+    exec_id = client.api.exec_create(instance.id, ["/bin/sh", "-c", command], stdout=True, stderr=True)
+    buffers = {"stdout": [], "stderr": []}
+    sizes = {"stdout": 0, "stderr": 0}
+    for chunks in client.api.exec_start(exec_id["Id"], stream=True, demux=True):
+        for stream, chunk in zip(("stdout", "stderr"), chunks):
+            if not chunk:
+                continue
+            text = chunk.decode("utf-8", errors="replace")
+            if not events.closed:
+                loop.call_soon_threadsafe(events.publish, {
+                    "command_id": command_id, "instance_id": instance.id, "type": stream, "data": text
+                })
+            if sizes[stream] < OUTPUT_LIMIT:
+                buffers[stream].append(text[:OUTPUT_LIMIT - sizes[stream]])
+                sizes[stream] += len(text)
+    exit_code = client.api.exec_inspect(exec_id["Id"])["ExitCode"]
+    return exit_code, "".join(buffers["stdout"]), "".join(buffers["stderr"])
+
+
+async def _invoke(executor, events, semaphore, command_id, instance, command):
+    """
+    Run the command on one instance and record the result.
+    Never raises: any failure (exec or database) marks the invocation as failed.
+    """
+    loop = asyncio.get_running_loop()
+    async with semaphore:
+        exit_code, stdout, stderr, status = None, "", "", "failed"
+        try:
+            await loop.run_in_executor(executor, partial(
+                _save_invocation, command_id, instance.id, status="in_progress", started_at=datetime.now()
+            ))
+            events.publish({"command_id": command_id, "instance_id": instance.id, "type": "started"})
+            exit_code, stdout, stderr = await loop.run_in_executor(
+                executor, _exec, loop, events, command_id, instance, command
+            )
+            status = "success" if exit_code == 0 else "failed"
+        except Exception as e:
+            stderr = str(e)
+            events.publish({"command_id": command_id, "instance_id": instance.id, "type": "stderr", "data": str(e)})
+        try:
+            await loop.run_in_executor(executor, partial(
+                _save_invocation, command_id, instance.id, status=status, exit_code=exit_code,
+                stdout=stdout, stderr=stderr, completed_at=datetime.now()
+            ))
+        except Exception as e:
+            print(f"Could not record result of command {command_id} on {instance.id}: {e}")
+            status = "failed"
+        events.publish({"command_id": command_id, "instance_id": instance.id, "type": "exit",
+                        "status": status, "exit_code": exit_code})
+        return status
+
+
+async def run(command_id: str, command: str, instances, max_concurrency: int, events: EventStream):
+    """
+    Fan a command out to all instances with at most `max_concurrency` execs in flight.
+    Events are published to `events`, always ending with a {"type": "done"} event.
+    Runs to completion (and persists results) even if nobody consumes the events.
+    Execs and result writes run on a dedicated pool of `max_concurrency` threads, so a
+    large fan-out neither starves nor is capped by the event loop's default executor.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"ssm-{command_id[:8]}")
+    status = "failed"
+    try:
+        # Returns only once every invocation has settled; errors count as failures.
+        statuses = await asyncio.gather(*[
+            _invoke(executor, events, semaphore, command_id, i, command) for i in instances
+        ], return_exceptions=True)
+        status = "success" if all(s == "success" for s in statuses) else "failed"
+    finally:
+        try:
+            await asyncio.get_running_loop().run_in_executor(executor, _finish_command, command_id, status)
+        except Exception as e:
+            print(f"Could not record status of command {command_id}: {e}")
+        finally:
+            executor.shutdown(wait=False)
+            events.publish({"command_id": command_id, "type": "done", "status": status})
+
+
+def start(command_id: str, command: str, instances, max_concurrency: int) -> EventStream:
+    """
+    Launch run() in the background and return the event stream it publishes to.
+    """
+    events = EventStream()
+    events.publish({"command_id": command_id, "type": "command", "instance_ids": [i.id for i in instances]})
+    task = asyncio.create_task(run(command_id, command, instances, max_concurrency, events))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return events
+
+
+async def stream_events(events: EventStream, fmt: str):
+    """
+    Serialize events as NDJSON lines or SSE messages until the command is done.
+    Closing the generator (client disconnect) stops further events from being buffered.
+    """
+    try:
+        while True:
+            event = await events.queue.get()
+            data = json.dumps(event)
+            yield f"event: {event['type']}\ndata: {data}\n\n" if fmt == "sse" else data + "\n"
+            if event["type"] == "done":
+                return
+    finally:
+        events.close()
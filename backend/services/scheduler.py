@@ -0,0 +1,74 @@
+import os
+from contextlib import contextmanager
+from fastapi import HTTPException
+from services import capacity, docker_nodes
+
+# How a node is chosen for a new container:
+# - "capacity": the node with the most uncommitted memory (then fewest running containers).
+# - "locality": nodes that already have the image first, then by capacity.
+# - "spread": the node with the fewest running containers.
+PLACEMENT_STRATEGY = os.getenv("PLACEMENT_STRATEGY", "capacity")
+
+
+def _candidates(image: str, strategy: str, running_types_by_node: dict):
+    """
+    Collect (node, host, score) for every reachable node, best first.
+    Unreachable nodes are skipped so one dead daemon does not block launches.
+    """
+    candidates = []
+    for node in docker_nodes.all_nodes():
+        try:
+            info = node.client.info()
+            has_image = node.has_image(image) if strategy == "locality" else False
+        except Exception as e:
+            print(f"Skipping Docker node {node.name}: {e}")
+            continue
+
+        host = capacity.host_capacity(info)
+        with capacity._lock:
+            committed = capacity.committed_capacity(node.name, running_types_by_node.get(node.name, []))
+        free_memory = capacity.allocatable_capacity(host)["memory_mb"] - committed["memory_mb"]
+        running = info.get("ContainersRunning", 0)
+
+        if strategy == "spread":
+            score = (-running, free_memory)
+        elif strategy == "locality":
+            score = (has_image, free_memory, -running)
+        else:
+            score = (free_memory, -running)
+        candidates.append((node, host, score))
+
+    candidates.sort(key=lambda c: c[2], reverse=True)
+    return candidates
+
+
+@contextmanager
+def place(image: str, running_types_by_node: dict, instance_type: str, strategy: str = None):
+    """
+    Choose a Docker node for a new EC2 instance, or an RDS instance
+    (instance_type is then its engine profile, see capacity.DB_ENGINE_PROFILES).
+    - running_types_by_node maps node name -> instance types running there; it is only
+      used to rank nodes, admission re-reads the running instances under its lock.
+    - The node must pass capacity admission; the reservation is held for the
+      duration of the block (see capacity.reserve).
+    Yields the chosen DockerNode.
+    Raises HTTPException 503 if no node is reachable or none has capacity.
+    """
+    candidates = _candidates(image, strategy or PLACEMENT_STRATEGY, running_types_by_node)
+    if not candidates:
+        raise HTTPException(503, "No Docker nodes available")
+
+    spec = capacity.get_profile(instance_type)
+    last_error = None
+    for node, host, _ in candidates:
+        try:
+            reservation_id = capacity.admit(node.name, host, spec, instance_type)
+        except HTTPException as e:
+            last_error = e
+            continue
+        try:
+            yield node
+        finally:
+            capacity.release(reservation_id)
+        return
+    raise last_error
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Downsampled history kept per container: HISTORY_WINDOW_SECONDS at HISTORY_RESOLUTION_SECONDS.
+HISTORY_RESOLUTION_SECONDS = int(os.getenv("STATS_HISTORY_RESOLUTION_SECONDS", "10"))
+HISTORY_WINDOW_SECONDS = int(os.getenv("STATS_HISTORY_WINDOW_SECONDS", "3600"))
+# Upstream streams with no subscribers and no history queries for this long are closed.
+IDLE_TIMEOUT_SECONDS = int(os.getenv("STATS_IDLE_TIMEOUT_SECONDS", "300"))
+# Samples buffered per subscriber; slow clients drop the oldest samples instead of stalling others.
+SUBSCRIBER_BUFFER = 16
+# How long a stats query on a freshly started stream waits for its first sample.
+FIRST_SAMPLE_TIMEOUT_SECONDS = 3
+
+# One upstream stream per (node, container id), shared by every viewer.
+_streams = {}
+# Downsampled history per (node, container id). Outlives the stream, so an idle
+# stream can be closed without losing the history collected so far.
+_histories = {}
+_lock = threading.Lock()
+
+
+def summarize(raw: dict) -> dict:
+    """
+    Reduce a raw Docker stats document to CPU, memory, network, block I/O and pids figures.
+    """
+    cpu, precpu = raw.get("cpu_stats", {}), raw.get("precpu_stats", {})
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    online_cpus = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or []) or 1
+    cpu_percent = cpu_delta / system_delta * online_cpus * 100 if system_delta > 0 and cpu_delta > 0 else 0.0
+
+    memory = raw.get("memory_stats", {})
+    mem_detail = memory.get("stats", {})
+    # Page cache is reclaimable; "docker stats" subtracts it the same way (cgroup v2 / v1).
+    cache = mem_detail.get("inactive_file", mem_detail.get("total_inactive_file", mem_detail.get("cache", 0)))
+    memory_usage = max(memory.get("usage", 0) - cache, 0)
+
+    networks = raw.get("networks") or {}
+    blkio = (raw.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+
+    return {
+        "timestamp": time.time(),
+        "cpu_percent": round(cpu_percent, 2),
+        "memory_usage": memory_usage,
+        "memory_limit": memory.get("limit", 0),
+        "network_rx_bytes": sum(n.get("rx_bytes", 0) for n in networks.values()),
+        "network_tx_bytes": sum(n.get("tx_bytes", 0) for n in networks.values()),
+        "block_read_bytes": sum(e.get("value", 0) for e in blkio if e.get("op", "").lower() == "read"),
+        "block_write_bytes": sum(e.get("value", 0) for e in blkio if e.get("op", "").lower() == "write"),
+        "pids": (raw.get("pids_stats") or {}).get("current", 0),
+    }
+
+
+class StatsStream:
+    """
+    A single `docker stats` stream for one container, fanned out to any number of subscribers.
+    - The blocking Docker stream is read in a daemon thread; samples are handed to the event loop.
+    - Every sample goes to every subscriber queue.
+    - A history of HISTORY_RESOLUTION_SECONDS buckets is kept for instant history queries
+      (CPU is averaged over the bucket, counters and gauges take the last value).
+      It is shared with later streams of the same container (see _histories).
+    Must be created under _lock.
+    """
+    def __init__(self, key, client, container_id: str, loop):
+        self.key = key
+        self.client = client
+        self.container_id = container_id
+        self.loop = loop
+        self.subscribers = set()
+        self.latest = None
+        self.history = _histories.setdefault(key, deque(maxlen=HISTORY_WINDOW_SECONDS // HISTORY_RESOLUTION_SECONDS))
+        self.ready = asyncio.Event()
+        self.last_access = time.monotonic()
+        self._bucket = None
+        self._bucket_cpu = []
+        self._bucket_last = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read, name=f"stats-{container_id[:12]}", daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        try:
+            for raw in self.client.api.stats(self.container_id, decode=True, stream=True):
+                if self._stopped:
+                    break
+                self.loop.call_soon_threadsafe(self._publish, summarize(raw))
+        except Exception as e:
+            print(f"Stats stream for {self.container_id[:12]} failed: {e}")
+        finally:
+            self.loop.call_soon_threadsafe(self._close)
+
+    def _publish(self, sample: dict):
+        self.latest = sample
+        self.ready.set()
+        bucket = int(sample["timestamp"] // HISTORY_RESOLUTION_SECONDS)
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush_bucket()
+        self._bucket = bucket
+        self._bucket_cpu.append(sample["cpu_percent"])
+        self._bucket_last = sample
+
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(sample)
+
+        if not self.subscribers and time.monotonic() - self.last_access > IDLE_TIMEOUT_SECONDS:
+            self._stopped = True
+
+    def _flush_bucket(self):
+        point = dict(self._bucket_last)
+        point["timestamp"] = self._bucket * HISTORY_RESOLUTION_SECONDS
+        point["cpu_percent"] = round(sum(self._bucket_cpu) / len(self._bucket_cpu), 2)
+        if self.history and self.history[-1]["timestamp"] == point["timestamp"]:
+            # Bucket already flushed by a previous stream of the same container.
+            self.history.pop()
+        self.history.append(point)
+        self._bucket_cpu = []
+
+    def _close(self):
+        self._stopped = True
+        self.ready.set()
+        if self._bucket_last is not None:
+            self._flush_bucket()
+            self._bucket_last = None
+        with _lock:
+            if _streams.get(self.key) is self:
+                del _streams[self.key]
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self.subscribers.add(queue)
+        self.last_access = time.monotonic()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        self.last_access = time.monotonic()
+
+    def snapshot(self) -> dict:
+        self.last_access = time.monotonic()
+        return {
+            "container_id": self.container_id,
+            "resolution_seconds": HISTORY_RESOLUTION_SECONDS,
+            "latest": self.latest,
+            "history": list(self.history),
+        }
+
+    async def ready_snapshot(self, timeout: float = FIRST_SAMPLE_TIMEOUT_SECONDS) -> dict:
+        """
+        snapshot(), after waiting up to `timeout` seconds for the first sample of a new stream.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.snapshot()
+
+
+def _prune_histories():
+    """
+    Drop histories of containers with no stream whose newest point has left the window.
+    Must be called under _lock.
+    """
+    cutoff = time.time() - HISTORY_WINDOW_SECONDS
+    for key in [k for k, h in _histories.items() if k not in _streams and (not h or h[-1]["timestamp"] < cutoff)]:
+        del _histories[key]
+
+
+def get_stream(node, container_id: str) -> StatsStream:
+    """
+    Return the shared stats stream for a container, starting it if needed.
+    Must be called from the event loop.
+    """
+    key = (node.name, container_id)
+    with _lock:
+        stream = _streams.get(key)
+        if stream is None or stream._stopped:
+            _prune_histories()
+            stream = StatsStream(key, node.client, container_id, asyncio.get_running_loop())
+            _streams[key] = stream
+        return stream
+
+
+async def sse(stream: StatsStream):
+    """
+    Server-sent events for one subscriber of a stats stream; ends when the container stops.
+    """
+    queue = stream.subscribe()
+    try:
+        if stream.latest:
+            yield f"data: {json.dumps(stream.latest)}\n\n"
+        while True:
+            sample = await queue.get()
+            if sample is None:
+                yield "event: end\ndata: {}\n\n"
+                return
+            yield f"data: {json.dumps(sample)}\n\n"
+    finally:
+        stream.unsubscribe(queue)